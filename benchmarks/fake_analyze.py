@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""Stand-in for FreeLing's 'analyze' executable, for benchmarking the plugin without a FreeLing installation.
+
+Speaks the same protocol as 'analyze --output json --flush': every line read from stdin is tokenised and split into
+sentences, and every sentence is written to stdout as one JSON object, with character offsets counted over the whole
+input stream. Like FreeLing, every token (and every node of the dependency tree) is written on a line of its own, with
+the closing brackets at the end of the last line. The tagging is of course made up. With '--outlv dep', every sentence
+also gets a made-up dependency tree.
+
+The behaviour can be scripted through environment variables:
+
+    FAKE_FREELING_STARTUP_DELAY   Seconds to sleep before reading any input (simulates loading dictionaries).
+    FAKE_FREELING_TOKEN_LATENCY   Seconds to spend on every token.
+    FAKE_FREELING_STDERR_NOISE    Number of "TAGSET: No rule ..." lines to write to stderr for every token.
+    FAKE_FREELING_HANG_ON         Stop responding when this word is seen.
+    FAKE_FREELING_CRASH_ON        Exit with an error when this word is seen.
+"""
+
+import json
+import os
+import re
+import sys
+import time
+
+TOKEN = re.compile(r"\w+|[^\w\s]")
+SENTENCE_FINAL = {".", "!", "?"}
+TAGS = ["NCMS000", "NCFP000", "VMIP3S0", "AQ0MS00", "RG", "SP", "DA0MS0", "CC", "PP3MS000", "VMN0000"]
+
+
+def tag_token(form):
+    """Make up a tag for a token."""
+    if not form[0].isalnum():
+        return "Fp"
+    if form.isdigit():
+        return "Z"
+    if form[0].isupper():
+        return "NP00000"
+    return TAGS[sum(map(ord, form)) % len(TAGS)]
+
+
+def dependency(position, tag):
+    """Make up the head (1-based position, 0 for the root) and relation of the token at 'position' (1-based).
+
+    The tokens form a balanced binary tree, so that long sentences do not make the JSON output deeply nested.
+    """
+    if position == 1:
+        return 0, "top"
+    return position // 2, "f" if tag == "Fp" else "mod"
+
+
+def dependency_tree(tokens):
+    """Make up the dependency tree of a sentence, in FreeLing's JSON format."""
+    nodes = [{"token": token["id"], "function": dependency(i, token["tag"])[1], "word": token["form"]}
+             for i, token in enumerate(tokens, 1)]
+    for i, node in enumerate(nodes[1:], 2):
+        nodes[i // 2 - 1].setdefault("children", []).append(node)
+    return [nodes[0]]
+
+
+def format_fields(item):
+    """Format the fields of a token or dependency node, except its children."""
+    return ", ".join(f"{json.dumps(name)} : {json.dumps(value)}" for name, value in item.items() if name != "children")
+
+
+def format_node(node, indent):
+    """Format a dependency node and its children, one node per line."""
+    if "children" not in node:
+        return f"{indent}{{ {format_fields(node)} }}"
+    children = ",\n".join(format_node(child, indent + "  ") for child in node["children"])
+    return f"{indent}{{ {format_fields(node)}, \"children\" : [\n{children}]}}"
+
+
+def format_sentence(sentence):
+    """Format a sentence as a JSON object in the multi-line layout of FreeLing's JSON output."""
+    tokens = ",\n".join(f"       {{ {format_fields(token)} }}" for token in sentence["tokens"])
+    text = f"{{ \"sentences\" : [\n  {{ \"id\":\"{sentence['id']}\",\n    \"tokens\" : [\n{tokens}]"
+    if "dependencies" in sentence:
+        nodes = ",\n".join(format_node(node, "       ") for node in sentence["dependencies"])
+        text += f",\n    \"dependencies\" : [\n{nodes}]"
+    return text + "}]}\n"
+
+
+def main():
+    """Read lines from stdin and write a JSON analysis of every sentence to stdout."""
+    if "--version" in sys.argv:
+        print("analyze (fake) version 0.1")
+        return
+
+    startup_delay = float(os.environ.get("FAKE_FREELING_STARTUP_DELAY", 0))
+    token_latency = float(os.environ.get("FAKE_FREELING_TOKEN_LATENCY", 0))
+    stderr_noise = int(os.environ.get("FAKE_FREELING_STDERR_NOISE", 0))
+    hang_on = os.environ.get("FAKE_FREELING_HANG_ON")
+    crash_on = os.environ.get("FAKE_FREELING_CRASH_ON")
+    ner = "--nec" in sys.argv
+    parse = "--outlv dep" in sys.argv
+
+    time.sleep(startup_delay)
+
+    offset = 0
+    sentence_id = 0
+    for raw_line in sys.stdin.buffer:
+        line = raw_line.decode("utf-8")
+        sentences = [[]]
+        for m in TOKEN.finditer(line):
+            form = m.group(0)
+            if form == hang_on:
+                time.sleep(1000000)
+            if form == crash_on:
+                sys.exit("Fake FreeLing crashed")
+            token = {"begin": str(offset + m.start()), "end": str(offset + m.end()), "form": form,
+                     "lemma": form.lower(), "tag": tag_token(form)}
+            if ner and token["tag"] == "NP00000":
+                token["tag"] = "NP00SP0"
+                token["neclass"] = "person"
+            sentences[-1].append(token)
+            if form in SENTENCE_FINAL:
+                sentences.append([])
+
+        n_tokens = sum(map(len, sentences))
+        if stderr_noise:
+            sys.stderr.write("TAGSET: No rule to get short version of tag 'X'.\n" * (stderr_noise * n_tokens))
+            sys.stderr.flush()
+        if token_latency:
+            time.sleep(token_latency * n_tokens)
+
+        for tokens in sentences:
+            if tokens:
+                sentence_id += 1
+                tokens = [{"id": f"t{sentence_id}.{i}", **token} for i, token in enumerate(tokens, 1)]
+                sentence = {"id": str(sentence_id), "tokens": tokens}
+                if parse:
+                    sentence["dependencies"] = dependency_tree(tokens)
+                sys.stdout.write(format_sentence(sentence))
+        sys.stdout.flush()
+        offset += len(line)
+
+
+if __name__ == "__main__":
+    main()
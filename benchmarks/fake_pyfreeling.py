@@ -0,0 +1,203 @@
+"""Stand-in for FreeLing's Python bindings (the 'pyfreeling' module), for benchmarking the "pyfreeling" backend.
+
+Implements the parts of the API that the backend uses, and makes up the same analyses as fake_analyze.py, so that both
+backends give identical results on the fake FreeLing. FAKE_FREELING_STARTUP_DELAY and FAKE_FREELING_TOKEN_LATENCY are
+supported as well.
+"""
+
+import os
+import time
+
+from fake_analyze import SENTENCE_FINAL, TOKEN, dependency, tag_token
+
+__version__ = "0.1 (fake)"
+
+
+class word:  # noqa: N801  Same names as in the real bindings
+    """A token."""
+
+    def __init__(self, form, start, finish):
+        self.form = form
+        self.start = start
+        self.finish = finish
+        self.lemma = ""
+        self.tag = ""
+        self.position = 0
+
+    def get_form(self):
+        return self.form
+
+    def get_lemma(self):
+        return self.lemma
+
+    def get_tag(self):
+        return self.tag
+
+    def get_span_start(self):
+        return self.start
+
+    def get_span_finish(self):
+        return self.finish
+
+    def get_position(self):
+        return self.position
+
+
+class sentence:  # noqa: N801
+    """A list of words."""
+
+    def __init__(self, words):
+        self.words = words
+        self.dep_tree = None
+        for i, w in enumerate(words):
+            w.position = i
+
+    def get_words(self):
+        return self.words
+
+    def get_dep_tree(self):
+        return self.dep_tree
+
+
+class depnode:  # noqa: N801
+    """A node of a dependency tree, which is also its own tree (begin() returns the root node)."""
+
+    def __init__(self, w, label):
+        self.word = w
+        self.label = label
+        self.children = []
+
+    def begin(self):
+        return self
+
+    def get_word(self):
+        return self.word
+
+    def get_label(self):
+        return self.label
+
+    def num_children(self):
+        return len(self.children)
+
+    def nth_child_ref(self, i):
+        return self.children[i]
+
+
+def util_init_locale(locale):
+    pass
+
+
+class tokenizer:  # noqa: N801
+    def __init__(self, data_file):
+        time.sleep(float(os.environ.get("FAKE_FREELING_STARTUP_DELAY", 0)))
+
+    def tokenize(self, text):
+        return [word(m.group(0), m.start(), m.end()) for m in TOKEN.finditer(text)]
+
+
+class splitter:  # noqa: N801
+    def __init__(self, data_file):
+        self.sessions = {}
+
+    def open_session(self):
+        session = len(self.sessions)
+        self.sessions[session] = []
+        return session
+
+    def close_session(self, session):
+        del self.sessions[session]
+
+    def split(self, session, words, flush):
+        pending = self.sessions[session]
+        sentences = []
+        for w in words:
+            pending.append(w)
+            if w.get_form() in SENTENCE_FINAL:
+                sentences.append(sentence(pending))
+                pending = []
+        if flush and pending:
+            sentences.append(sentence(pending))
+            pending = []
+        self.sessions[session] = pending
+        return sentences
+
+
+class maco_options:  # noqa: N801
+    def __init__(self, lang):
+        pass
+
+    def set_data_files(self, *files):
+        pass
+
+
+class maco:  # noqa: N801
+    def __init__(self, options):
+        pass
+
+    def set_active_options(self, *options):
+        pass
+
+    def analyze(self, sentences):
+        for s in sentences:
+            for w in s.get_words():
+                w.lemma = w.get_form().lower()
+        return sentences
+
+
+class hmm_tagger:  # noqa: N801
+    def __init__(self, data_file, retokenize, force_select, kbest=1):
+        self.token_latency = float(os.environ.get("FAKE_FREELING_TOKEN_LATENCY", 0))
+
+    def analyze(self, sentences):
+        for s in sentences:
+            for w in s.get_words():
+                w.tag = tag_token(w.get_form())
+            if self.token_latency:
+                time.sleep(self.token_latency * len(s.get_words()))
+        return sentences
+
+
+class relax_tagger(hmm_tagger):  # noqa: N801
+    def __init__(self, data_file, max_iter, scale_factor, epsilon, retokenize, force_select):
+        super().__init__(data_file, retokenize, force_select)
+
+
+class chart_parser:  # noqa: N801
+    def __init__(self, data_file):
+        pass
+
+    def get_start_symbol(self):
+        return "S"
+
+    def analyze(self, sentences):
+        return sentences
+
+
+class dep_txala:  # noqa: N801
+    def __init__(self, data_file, start_symbol):
+        pass
+
+    def analyze(self, sentences):
+        for s in sentences:
+            nodes = [depnode(w, dependency(i, w.get_tag())[1]) for i, w in enumerate(s.get_words(), 1)]
+            for i, node in enumerate(nodes[1:], 2):
+                nodes[dependency(i, "")[0] - 1].children.append(node)
+            s.dep_tree = nodes[0]
+        return sentences
+
+
+class dep_treeler(dep_txala):  # noqa: N801
+    def __init__(self, data_file):
+        super().__init__(data_file, None)
+
+
+class nec:  # noqa: N801
+    def __init__(self, data_file):
+        pass
+
+    def analyze(self, sentences):
+        for s in sentences:
+            for w in s.get_words():
+                if w.tag == "NP00000":
+                    w.tag = "NP00SP0"
+        return sentences
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""Measure the throughput of the FreeLing wrapper using the fake FreeLing executable in fake_analyze.py.
+
+Every scenario runs freeling.main() on a generated document in a separate Python process (so that peak memory can be
+measured per scenario) and reports tokens per second, request latency percentiles and peak RSS.
+
+Examples:
+    python benchmarks/run_benchmarks.py --save baseline.json
+    python benchmarks/run_benchmarks.py --compare baseline.json --setting workers=4
+    python benchmarks/run_benchmarks.py --scenario chunk-large-long --env FAKE_FREELING_TOKEN_LATENCY=0.0001
+"""
+
+import argparse
+import itertools
+import json
+import logging
+import os
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import types
+from pathlib import Path
+
+BENCHMARK_DIR = Path(__file__).resolve().parent
+FAKE_BINARY = BENCHMARK_DIR / "fake_analyze.py"
+
+DOCUMENT_SIZES = {"small": 20000, "large": 2000000}
+CHUNK_SIZES = {"short": 200, "long": 20000}
+WORDS = ["the", "corpus", "analysis", "of", "Sparv", "is", "a", "pipeline", "for", "text", "and", "FreeLing", "tags",
+         "every", "token", "with", "its", "lemma", "in", "many", "languages", "such", "as", "Spanish", "or", "2023"]
+
+
+def scenarios():
+    """Get the names of all scenarios (the chunk size only matters in chunk mode)."""
+    return (["-".join(parts) for parts in itertools.product(["chunk"], DOCUMENT_SIZES, CHUNK_SIZES)]
+            + ["-".join(parts) for parts in itertools.product(["sentence"], DOCUMENT_SIZES)])
+
+
+################################################################################
+# Stand-ins for the Sparv classes used by freeling.main()
+################################################################################
+
+class FakeText:
+    """Corpus text held in memory."""
+
+    def __init__(self, text):
+        self.text = text
+
+    def read(self):
+        return self.text
+
+
+class FakeAnnotation:
+    """Span annotation held in memory."""
+
+    def __init__(self, spans):
+        self.spans = spans
+
+    def __bool__(self):
+        return True
+
+    def read_spans(self):
+        return iter(self.spans)
+
+
+class FakeOutput:
+    """Output that only consumes the values, to include the cost of reading them."""
+
+    def __init__(self):
+        self.count = 0
+
+    def write(self, values, append=False):
+        self.count = (self.count if append else 0) + sum(1 for _ in values)
+
+
+################################################################################
+# Running a single scenario
+################################################################################
+
+def make_document(size, chunk_size, seed=1):
+    """Generate a document of about 'size' characters, with text chunks and sentences as lists of spans."""
+    rnd = random.Random(seed)
+    parts = []
+    sentences = []
+    chunks = []
+    length = 0
+    chunk_start = 0
+    while length < size:
+        words = [rnd.choice(WORDS) for _ in range(rnd.randint(3, 25))]
+        sentence = " ".join(words) + rnd.choice([".", ".", ".", "!", "?"])
+        sentences.append((length, length + len(sentence)))
+        parts.append(sentence)
+        length += len(sentence)
+        if length - chunk_start >= chunk_size:
+            chunks.append((chunk_start, length))
+            chunk_start = length + 1
+        parts.append("\n" if rnd.random() < 0.1 else " ")
+        length += 1
+    if chunk_start < length - 1:
+        chunks.append((chunk_start, length - 1))
+    return "".join(parts), chunks, sentences
+
+
+def run_scenario(name, settings, lang):
+    """Run one scenario in this process and return the results as a dictionary."""
+    sys.path.insert(0, str(BENCHMARK_DIR.parent))
+    sys.path.insert(0, str(BENCHMARK_DIR))
+    from sparv.core import log_handler  # Adds the progress() method to loggers
+    from sbx_freeling import freeling
+
+    # Use the fake bindings for the "pyfreeling" backend
+    import fake_pyfreeling
+    sys.modules["pyfreeling"] = fake_pyfreeling
+
+    # Show warnings from the wrapper, but not the progress records meant for Sparv's progress bar
+    handler = logging.StreamHandler()
+    handler.addFilter(log_handler.ProgressInternalFilter())
+    logging.basicConfig(level=logging.WARNING, handlers=[handler])
+
+    mode, document_size, chunk_size = (name.split("-") + ["long"])[:3]
+    text, chunks, sentences = make_document(DOCUMENT_SIZES[document_size], CHUNK_SIZES[chunk_size])
+
+    # Measure the time of every request sent to FreeLing
+    latencies = []
+    run_freeling_batch = freeling.run_freeling_batch
+
+    def timed_run_freeling_batch(*args, **kwargs):
+        started = time.perf_counter()
+        result = run_freeling_batch(*args, **kwargs)
+        latencies.append(time.perf_counter() - started)
+        return result
+
+    freeling.run_freeling_batch = timed_run_freeling_batch
+
+    outputs = {name: FakeOutput() for name in ("token", "baseform", "upos", "pos", "sentence", "ne_type", "deprel",
+                                               "dephead", "dephead_ref")}
+    if settings.pop("parse", False):
+        # Run the dependency parsing annotator
+        settings.update(out_deprel=outputs["deprel"], out_dephead=outputs["dephead"],
+                        out_dephead_ref=outputs["dephead_ref"])
+    conf_file = types.SimpleNamespace(path=os.devnull)
+    sentence_chunk = FakeAnnotation(chunks) if mode == "chunk" else None
+    sentence_annotation = FakeAnnotation(sentences) if mode == "sentence" else None
+
+    corpus_text = FakeText(text)
+    if settings.get("spill"):
+        # Spill mode reads the text from Sparv's work directory
+        from sparv.api import Text
+        from sparv.core import paths
+        work_dir = tempfile.TemporaryDirectory(prefix="sbx_freeling_benchmark-")
+        paths.work_dir = Path(work_dir.name)
+        corpus_text = Text("benchmark")
+        corpus_text.write(text)
+
+    started = time.perf_counter()
+    freeling.main(corpus_text, lang, conf_file, str(FAKE_BINARY), sentence_chunk, outputs["token"],
+                  outputs["baseform"], outputs["upos"], outputs["pos"], outputs["sentence"], sentence_annotation,
+                  settings.pop("timeout", 300), outputs["ne_type"], **settings)
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "scenario": name,
+        "chars": len(text),
+        "chunks": len(chunks) if mode == "chunk" else len(sentences),
+        "tokens": outputs["token"].count,
+        "seconds": elapsed,
+        "tokens_per_second": outputs["token"].count / elapsed,
+        "latency_p50": percentile(latencies, 50),
+        "latency_p90": percentile(latencies, 90),
+        "latency_p99": percentile(latencies, 99),
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    }
+
+
+def percentile(values, p):
+    """Get the p:th percentile of a sorted list."""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+################################################################################
+# Running all scenarios and reporting
+################################################################################
+
+def parse_setting(setting):
+    """Parse a 'name=value' setting, where value is JSON if possible."""
+    name, _, value = setting.partition("=")
+    try:
+        value = json.loads(value)
+    except json.JSONDecodeError:
+        pass
+    return name, value
+
+
+def run_all(args):
+    """Run the selected scenarios in subprocesses and return their results."""
+    env = dict(os.environ, **dict(e.split("=", 1) for e in args.env))
+    parse = dict(parse_setting(s) for s in args.setting).get("parse", False)
+    results = []
+    for name in args.scenario or scenarios():
+        if args.quick and "large" in name:
+            continue
+        # The dependency parsing annotator cannot be used with an existing sentence segmentation
+        if parse and name.startswith("sentence"):
+            continue
+        runs = []
+        for _ in range(args.repeat):
+            cmd = [sys.executable, __file__, "--run-scenario", name, "--lang", args.lang,
+                   *itertools.chain.from_iterable(("--setting", s) for s in args.setting)]
+            process = subprocess.run(cmd, env=env, stdout=subprocess.PIPE, check=True)
+            runs.append(json.loads(process.stdout.decode().splitlines()[-1]))
+        # Report the median run (by throughput)
+        runs.sort(key=lambda r: r["tokens_per_second"])
+        result = runs[len(runs) // 2]
+        results.append(result)
+        print_result(result)
+    return results
+
+
+def print_result(result, baseline=None):
+    """Print the results of one scenario, compared to a baseline if given."""
+    line = (f"{result['scenario']:<24} {result['tokens']:>9} tokens {result['tokens_per_second']:>10.0f} tok/s  "
+            f"p50 {result['latency_p50'] * 1000:>8.1f} ms  p90 {result['latency_p90'] * 1000:>8.1f} ms  "
+            f"p99 {result['latency_p99'] * 1000:>8.1f} ms  rss {result['peak_rss_mb']:>7.1f} MB")
+    if baseline:
+        change = 100 * (result["tokens_per_second"] / baseline["tokens_per_second"] - 1)
+        rss_change = 100 * (result["peak_rss_mb"] / baseline["peak_rss_mb"] - 1)
+        line += f"  throughput {change:+6.1f}%  rss {rss_change:+6.1f}%"
+    print(line, flush=True)
+
+
+def main():
+    """Parse command line arguments and run the benchmarks."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", action="append", choices=scenarios(),
+                        help="Scenario to run (may be repeated; default: all)")
+    parser.add_argument("--quick", action="store_true", help="Skip the large documents")
+    parser.add_argument("--repeat", type=int, default=1, help="Number of runs per scenario (the median is reported)")
+    parser.add_argument("--setting", action="append", default=[],
+                        help="Keyword argument for freeling.main() as name=value, e.g. workers=4 (may be repeated)")
+    parser.add_argument("--env", action="append", default=[],
+                        help="Environment variable for the fake FreeLing as NAME=value, e.g. "
+                             "FAKE_FREELING_TOKEN_LATENCY=0.0001 (may be repeated)")
+    parser.add_argument("--lang", default="spa", help="Language code to pass to the wrapper")
+    parser.add_argument("--save", metavar="FILE", help="Save the results as a baseline")
+    parser.add_argument("--compare", metavar="FILE", help="Compare the results to a saved baseline")
+    parser.add_argument("--run-scenario", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_scenario:
+        settings = dict(parse_setting(s) for s in args.setting)
+        print(json.dumps(run_scenario(args.run_scenario, settings, args.lang)))
+        return
+
+    results = run_all(args)
+
+    if args.compare:
+        baseline = {r["scenario"]: r for r in json.loads(Path(args.compare).read_text())["results"]}
+        print(f"\nCompared to {args.compare}:")
+        for result in results:
+            print_result(result, baseline.get(result["scenario"]))
+        common = [r for r in results if r["scenario"] in baseline]
+        if common:
+            ratio = statistics.geometric_mean(r["tokens_per_second"] / baseline[r["scenario"]]["tokens_per_second"]
+                                              for r in common)
+            print(f"Overall throughput change: {100 * (ratio - 1):+.1f}%")
+
+    if args.save:
+        Path(args.save).write_text(json.dumps({"settings": args.setting, "env": args.env, "results": results},
+                                              indent=2))
+
+
+if __name__ == "__main__":
+    main()
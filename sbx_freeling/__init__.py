@@ -10,5 +10,43 @@ __config__ = [
            description="Text chunk (annotation) to use as input when segmenting sentences"),
     Config("sbx_freeling.sentence_annotation", "", description="Optional existing sentence segmentation annotation"),
     Config("sbx_freeling.timeout", 300, datatype=int,
-           description="Timeout (in seconds) after which to kill FreeLing if it does not respond")
+           description="Timeout (in seconds) after which to kill FreeLing if it does not respond"),
+    Config("sbx_freeling.keep_alive", 0, datatype=int,
+           description="Stop FreeLing processes kept running by the Sparv preloader after they have been idle for this "
+                       "many seconds (0 to keep them running until the preloader exits)"),
+    Config("sbx_freeling.workers", 1, datatype=int, min=1,
+           description="Number of FreeLing processes to use in parallel for each document"),
+    Config("sbx_freeling.batch_size", 1, datatype=int, min=1,
+           description="Number of sentences to send to FreeLing at once when 'sbx_freeling.sentence_annotation' "
+                       "is set"),
+    Config("sbx_freeling.cache", "",
+           description="Path to a database file for caching FreeLing analyses between runs (empty to disable caching)"),
+    Config("sbx_freeling.cache_size", 1024, datatype=int, min=1,
+           description="Maximum size (in MB) of the FreeLing cache, after which the least recently used entries are "
+                       "removed"),
+    Config("sbx_freeling.coalesce_size", 0, datatype=int, min=0,
+           description="Send consecutive text chunks to FreeLing together in requests of up to this many characters, "
+                       "which speeds up corpora with many short texts (0 to disable)"),
+    Config("sbx_freeling.max_chunk_size", 0, datatype=int, min=0,
+           description="Split text chunks longer than this many characters into smaller pieces at blank lines or "
+                       "sentence boundaries before sending them to FreeLing (0 to disable)"),
+    Config("sbx_freeling.adaptive_timeout", True, datatype=bool,
+           description="Give up on a chunk long before 'sbx_freeling.timeout' if it takes much longer than expected "
+                       "from its length and FreeLing's speed so far"),
+    Config("sbx_freeling.max_rss", 0, datatype=int, min=0,
+           description="Restart FreeLing between chunks when it uses more than this many MB of memory (0 to disable)"),
+    Config("sbx_freeling.max_chunks", 0, datatype=int, min=0,
+           description="Restart FreeLing after it has processed this many chunks (0 to disable)"),
+    Config("sbx_freeling.backend", "pipe", choices=["pipe", "pyfreeling"],
+           description="How to run FreeLing: 'pipe' runs the FreeLing executable in a subprocess, 'pyfreeling' uses "
+                       "FreeLing's Python bindings in-process"),
+    Config("sbx_freeling.spill", False, datatype=bool,
+           description="Keep the memory use constant for very large documents by reading the text from a temporary "
+                       "file and writing the annotations bit by bit while the document is analysed"),
+    Config("sbx_freeling.corpus_analysis", "",
+           description="Set to 'sbx_freeling.analysis' to analyse all documents in a single job, sharing "
+                       "'sbx_freeling.workers' FreeLing processes and starting with the largest documents"),
+    Config("sbx_freeling.telemetry", "",
+           description="Path to a JSON file to which timers and counters are written for every document and the whole "
+                       "corpus (empty to disable)")
 ]
@@ -0,0 +1,89 @@
+"""Persistent cache of FreeLing analyses, shared between documents and Sparv runs."""
+
+import hashlib
+import sqlite3
+import time
+from pathlib import Path
+
+from sparv.api import get_logger, util
+
+logger = get_logger(__name__)
+
+# Maximum number of keys to look up in a single query
+QUERY_SIZE = 500
+
+
+class AnalysisCache:
+    """Content-addressed cache of analysed chunks, stored in an SQLite database.
+
+    Entries are keyed by a hash of the chunk text together with everything else that affects the analysis (see
+    'settings'). The least recently used entries are removed when the total size of the cache exceeds 'max_size' bytes.
+    """
+
+    def __init__(self, path, max_size, settings):
+        """Open (or create) the cache database.
+
+        Args:
+            path: Path to the database file (may start with '~'). Missing directories are created.
+            max_size: Maximum total size of the cached analyses in bytes.
+            settings: List of strings or bytes identifying the FreeLing setup (e.g. config, language and version).
+        """
+        self.max_size = max_size
+        path = Path(path).expanduser()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(str(path), timeout=60)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS chunks "
+                                "(key BLOB PRIMARY KEY, data BLOB, size INTEGER, last_used REAL)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS chunks_last_used ON chunks (last_used)")
+        self.connection.commit()
+
+        settings_hash = hashlib.sha256()
+        for setting in settings:
+            if isinstance(setting, str):
+                setting = setting.encode(util.constants.UTF8)
+            settings_hash.update(hashlib.sha256(setting).digest())
+        self.prefix = settings_hash.digest()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, text):
+        """Get the cache key for a chunk of text."""
+        return hashlib.sha256(self.prefix + text.encode(util.constants.UTF8)).digest()
+
+    def get_many(self, keys):
+        """Look up several keys at once and return a dictionary with the cached data of the keys that were found."""
+        keys = list(set(keys))
+        found = {}
+        for i in range(0, len(keys), QUERY_SIZE):
+            batch = keys[i:i + QUERY_SIZE]
+            placeholders = ",".join("?" * len(batch))
+            found.update(self.connection.execute(f"SELECT key, data FROM chunks WHERE key IN ({placeholders})",
+                                                 batch))
+        if found:
+            # Mark entries as recently used
+            now = time.time()
+            self.connection.executemany("UPDATE chunks SET last_used = ? WHERE key = ?",
+                                        ((now, key) for key in found))
+            self.connection.commit()
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items):
+        """Store a list of (key, data) tuples."""
+        now = time.time()
+        self.connection.executemany("INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?)",
+                                    ((key, data, len(data), now) for key, data in items))
+        self.connection.commit()
+
+    def close(self):
+        """Remove the least recently used entries if the cache has grown too large, and close the database."""
+        total_size = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM chunks").fetchone()[0]
+        if total_size > self.max_size:
+            self.connection.execute("DELETE FROM chunks WHERE key IN (SELECT key FROM (SELECT key, SUM(size) OVER "
+                                    "(ORDER BY last_used DESC) AS total FROM chunks) WHERE total > ?)",
+                                    (self.max_size,))
+            self.connection.commit()
+            logger.debug("Removed old entries from the FreeLing cache (size was %d bytes)", total_size)
+        logger.debug("FreeLing cache: %d hits, %d misses", self.hits, self.misses)
+        self.connection.close()
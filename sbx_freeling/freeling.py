@@ -1,29 +1,118 @@
 """Do analysis with FreeLing."""
 
+import base64
+import bisect
+import collections
+import functools
+import itertools
 import json
+import multiprocessing.util
 import os
 import queue
 import re
+import selectors
 import signal
+import struct
 import subprocess
 import threading
+import time
+import zlib
+from abc import ABC, abstractmethod
+from array import array
+from collections.abc import Sequence
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
 
-from sparv.api import Annotation, Binary, Config, Language, Model, Output, Text, annotator, get_logger, util
+from sparv.api import (AllSourceFilenames, Annotation, AnnotationAllSourceFiles, AnnotationData, Binary, Config,
+                       Language, Model, Output, OutputDataAllSourceFiles, SourceFilename, SparvErrorMessage, Text,
+                       annotator, get_logger, util)
 from sparv.api.util.tagsets import pos_to_upos
 from sparv.api.util.tagsets.pos_to_upos import FALLBACK
 
+from .cache import AnalysisCache
+from .spilled_text import SpilledText
+from .telemetry import Telemetry, write_report
+
 logger = get_logger(__name__)
 
 
 # Random token to signal end of input
 END = b"27345327645267453684527685"
+END_FORM = END.decode()
+
+# Boundaries for splitting oversized chunks (see split_span())
+BLANK_LINE = re.compile(r"\n[ \t]*\n")
+SENTENCE_END = re.compile(r"[.!?…][\"'»”’)\]]*(?=\s)")
+WHITESPACE = re.compile(r"\s")
+LINE_BREAK = re.compile(r"\n")
+
+# Texts shorter than this are not cut into smaller pieces when FreeLing fails on them
+MIN_RETRY_SIZE = 100
+
+# The pieces of a text that FreeLing failed on get a share of the time the text got, in proportion to their length, but
+# at least MIN_RETRY_TIMEOUT seconds
+MIN_RETRY_TIMEOUT = 1
+
+# Chunk deadlines with adaptive timeouts: ADAPTIVE_FACTOR times the expected time, but at least ADAPTIVE_MIN_TIMEOUT
+# seconds, and only once FreeLing has processed ADAPTIVE_MIN_CHARS characters to measure its speed on
+ADAPTIVE_FACTOR = 10
+ADAPTIVE_MIN_TIMEOUT = 10
+ADAPTIVE_MIN_CHARS = 10000
 
 # Languages supporting Named entity classification ("--nec" and "--ner" flags)
 NEC_LANGS = ["cat", "eng", "spa", "por"]
 
+# Maximum number of bytes to read from or write to the FreeLing pipes at once
+READ_SIZE = 65536
+
+# Maximum number of characters to send to FreeLing before the earlier input has been processed
+MAX_INPUT_AHEAD = 1000000
+
+# Number of new analyses to collect before writing them to the cache
+CACHE_WRITE_SIZE = 1000
+
+# With 'sbx_freeling.spill': Number of characters of input spans to analyse at a time, and number of tokens after
+# which the annotations are written
+SPILL_WINDOW_SIZE = 1000000
+SPILL_TOKENS = 100000
+
+# Name of the telemetry report of annotate_corpus(), which analyses all documents at once
+CORPUS_REPORT_NAME = "(corpus):annotate_corpus"
+
+# Version of the format written by TokenStore.to_bytes(), part of the cache settings so that old entries are not read
+CACHE_FORMAT = 2
+
+# Seconds to wait for FreeLing to exit after SIGTERM before sending SIGKILL
+KILL_TIMEOUT = 5
+
+# Minimum number of seconds between two measurements of the memory used by a FreeLing process
+RSS_CHECK_INTERVAL = 5
+
+
+def preloader(fl_binary, conf_file, lang, timeout, keep_alive, backend, parse=False):
+    """Start FreeLing in advance and keep it in a pool that the annotators can reuse.
+
+    Sparv runs every annotation job in a process of its own, so the preloader is what makes FreeLing processes survive
+    between documents. They are stopped after being idle for 'keep_alive' seconds (if set) and when the preloader exits.
+    Sparv may run the preloader in a forked worker process, which exits without running atexit handlers, so the pool is
+    shut down by a multiprocessing finalizer (run when the main process or a multiprocessing worker exits).
+    """
+    fl_pool = FreelingPool(keep_alive or None)
+    multiprocessing.util.Finalize(fl_pool, fl_pool.shutdown, exitpriority=10)
+    fl_instance = make_backend(backend, fl_binary, conf_file.path, lang, None, timeout, parse=parse)
+    fl_instance.wait_ready()
+    fl_pool.release(fl_instance)
+    return fl_pool
 
-@annotator("POS tags and baseforms from FreeLing", language=["ast", "fra", "glg", "ita", "nob", "rus", "slv"])
+
+def preloader_parse(fl_binary, conf_file, lang, timeout, keep_alive, backend):
+    """Start FreeLing with dependency parsing in advance (see preloader())."""
+    return preloader(fl_binary, conf_file, lang, timeout, keep_alive, backend, parse=True)
+
+
+@annotator("POS tags and baseforms from FreeLing", language=["ast", "fra", "glg", "ita", "nob", "rus", "slv"],
+           preloader=preloader, preloader_params=["fl_binary", "conf_file", "lang", "timeout", "keep_alive", "backend"],
+           preloader_target="fl_pool", preloader_shared=False)
 def annotate(corpus_text: Text = Text(),
              lang: Language = Language,
              conf_file: Model = Model("[sbx_freeling.conf]"),
@@ -36,13 +125,38 @@ def annotate(corpus_text: Text = Text(),
                                       description="Part-of-speeches from FreeLing"),
              out_sentence: Optional[Output] = Output("sbx_freeling.sentence", cls="sentence", description="Sentence segments"),
              sentence_annotation: Optional[Annotation] = Annotation("[sbx_freeling.sentence_annotation]"),
-             timeout: int = Config("sbx_freeling.timeout")):
-    """Run FreeLing and output sentences, tokens, baseforms, upos and pos."""
+             timeout: int = Config("sbx_freeling.timeout"),
+             keep_alive: int = Config("sbx_freeling.keep_alive"),
+             workers: int = Config("sbx_freeling.workers"),
+             batch_size: int = Config("sbx_freeling.batch_size"),
+             cache: str = Config("sbx_freeling.cache"),
+             cache_size: int = Config("sbx_freeling.cache_size"),
+             coalesce_size: int = Config("sbx_freeling.coalesce_size"),
+             max_chunk_size: int = Config("sbx_freeling.max_chunk_size"),
+             adaptive_timeout: bool = Config("sbx_freeling.adaptive_timeout"),
+             telemetry: str = Config("sbx_freeling.telemetry"),
+             max_rss: int = Config("sbx_freeling.max_rss"),
+             max_chunks: int = Config("sbx_freeling.max_chunks"),
+             backend: str = Config("sbx_freeling.backend"),
+             spill: bool = Config("sbx_freeling.spill"),
+             corpus_analysis: Optional[AnnotationData] = AnnotationData("[sbx_freeling.corpus_analysis]"),
+             source_file: SourceFilename = SourceFilename(),
+             fl_pool=None):
+    """Run FreeLing and output sentences, tokens, baseforms, upos and pos.
+
+    The fl_pool argument is set by the preloader and should never be set from the command line.
+    """
     main(corpus_text, lang, conf_file, fl_binary, sentence_chunk, out_token, out_baseform, out_upos, out_pos,
-         out_sentence, sentence_annotation, timeout)
+         out_sentence, sentence_annotation, timeout, fl_pool=fl_pool, workers=workers, batch_size=batch_size,
+         cache=cache, cache_size=cache_size, coalesce_size=coalesce_size, max_chunk_size=max_chunk_size,
+         adaptive_timeout=adaptive_timeout, telemetry=telemetry, max_rss=max_rss, max_chunks=max_chunks,
+         backend=backend, source_file=source_file, spill=spill, corpus_analysis=corpus_analysis,
+         annotator_name="annotate")
 
 
-@annotator("POS tags, baseforms and named entities from FreeLing", language=["cat", "deu", "eng", "spa", "por"])
+@annotator("POS tags, baseforms and named entities from FreeLing", language=["cat", "deu", "eng", "spa", "por"],
+           preloader=preloader, preloader_params=["fl_binary", "conf_file", "lang", "timeout", "keep_alive", "backend"],
+           preloader_target="fl_pool", preloader_shared=False)
 def annotate_full(corpus_text: Text = Text(),
                   lang: Language = Language(),
                   conf_file: Model = Model("[sbx_freeling.conf]"),
@@ -59,295 +173,1557 @@ def annotate_full(corpus_text: Text = Text(),
                   out_sentence: Optional[Output] = Output("sbx_freeling.sentence", cls="sentence",
                                                           description="Sentence segments"),
                   sentence_annotation: Optional[Annotation] = Annotation("[sbx_freeling.sentence_annotation]"),
-                  timeout: int = Config("sbx_freeling.timeout")):
-    """Run FreeLing and output the usual annotations plus named entity types."""
+                  timeout: int = Config("sbx_freeling.timeout"),
+                  keep_alive: int = Config("sbx_freeling.keep_alive"),
+                  workers: int = Config("sbx_freeling.workers"),
+                  batch_size: int = Config("sbx_freeling.batch_size"),
+                  cache: str = Config("sbx_freeling.cache"),
+                  cache_size: int = Config("sbx_freeling.cache_size"),
+                  coalesce_size: int = Config("sbx_freeling.coalesce_size"),
+                  max_chunk_size: int = Config("sbx_freeling.max_chunk_size"),
+                  adaptive_timeout: bool = Config("sbx_freeling.adaptive_timeout"),
+                  telemetry: str = Config("sbx_freeling.telemetry"),
+                  max_rss: int = Config("sbx_freeling.max_rss"),
+                  max_chunks: int = Config("sbx_freeling.max_chunks"),
+                  backend: str = Config("sbx_freeling.backend"),
+                  spill: bool = Config("sbx_freeling.spill"),
+                  corpus_analysis: Optional[AnnotationData] = AnnotationData("[sbx_freeling.corpus_analysis]"),
+                  source_file: SourceFilename = SourceFilename(),
+                  fl_pool=None):
+    """Run FreeLing and output the usual annotations plus named entity types.
+
+    The fl_pool argument is set by the preloader and should never be set from the command line.
+    """
     main(corpus_text, lang, conf_file, fl_binary, sentence_chunk, out_token, out_baseform, out_upos, out_pos,
-         out_sentence, sentence_annotation, timeout, out_ne_type)
+         out_sentence, sentence_annotation, timeout, out_ne_type, fl_pool=fl_pool, workers=workers,
+         batch_size=batch_size, cache=cache, cache_size=cache_size, coalesce_size=coalesce_size,
+         max_chunk_size=max_chunk_size, adaptive_timeout=adaptive_timeout, telemetry=telemetry, max_rss=max_rss,
+         max_chunks=max_chunks, backend=backend, source_file=source_file, spill=spill,
+         corpus_analysis=corpus_analysis, annotator_name="annotate_full")
+
+
+@annotator("POS tags, baseforms, named entities and dependency parses from FreeLing",
+           language=["ast", "cat", "deu", "eng", "glg", "por", "spa"],
+           preloader=preloader_parse,
+           preloader_params=["fl_binary", "conf_file", "lang", "timeout", "keep_alive", "backend"],
+           preloader_target="fl_pool", preloader_shared=False)
+def annotate_dep(corpus_text: Text = Text(),
+                 lang: Language = Language(),
+                 conf_file: Model = Model("[sbx_freeling.conf]"),
+                 fl_binary: Binary = Binary("[sbx_freeling.binary]"),
+                 sentence_chunk: Optional[Annotation] = Annotation("[sbx_freeling.sentence_chunk]"),
+                 out_token: Output = Output("sbx_freeling.dep_token", cls="token", description="Token segments"),
+                 out_baseform: Output = Output("sbx_freeling.dep_token:sbx_freeling.baseform",
+                                               description="Baseforms from FreeLing"),
+                 out_upos: Output = Output("sbx_freeling.dep_token:sbx_freeling.upos", cls="token:upos",
+                                           description="Part-of-speeches in UD"),
+                 out_pos: Output = Output("sbx_freeling.dep_token:sbx_freeling.pos", cls="token:pos",
+                                          description="Part-of-speeches from FreeLing"),
+                 out_ne_type: Output = Output("sbx_freeling.dep_token:sbx_freeling.ne_type",
+                                              cls="token:named_entity_type",
+                                              description="Named entitiy types from FreeLing"),
+                 out_deprel: Output = Output("sbx_freeling.dep_token:sbx_freeling.deprel", cls="token:deprel",
+                                             description="Dependency relations to the head"),
+                 out_dephead: Output = Output("sbx_freeling.dep_token:sbx_freeling.dephead", cls="token:dephead",
+                                              description="Positions of the dependency heads"),
+                 out_dephead_ref: Output = Output("sbx_freeling.dep_token:sbx_freeling.dephead_ref",
+                                                  cls="token:dephead_ref",
+                                                  description="Sentence-relative positions of the dependency heads"),
+                 out_sentence: Optional[Output] = Output("sbx_freeling.dep_sentence", cls="sentence",
+                                                         description="Sentence segments"),
+                 sentence_annotation: Optional[Annotation] = Annotation("[sbx_freeling.sentence_annotation]"),
+                 timeout: int = Config("sbx_freeling.timeout"),
+                 keep_alive: int = Config("sbx_freeling.keep_alive"),
+                 workers: int = Config("sbx_freeling.workers"),
+                 batch_size: int = Config("sbx_freeling.batch_size"),
+                 cache: str = Config("sbx_freeling.cache"),
+                 cache_size: int = Config("sbx_freeling.cache_size"),
+                 coalesce_size: int = Config("sbx_freeling.coalesce_size"),
+                 max_chunk_size: int = Config("sbx_freeling.max_chunk_size"),
+                 adaptive_timeout: bool = Config("sbx_freeling.adaptive_timeout"),
+                 telemetry: str = Config("sbx_freeling.telemetry"),
+                 max_rss: int = Config("sbx_freeling.max_rss"),
+                 max_chunks: int = Config("sbx_freeling.max_chunks"),
+                 backend: str = Config("sbx_freeling.backend"),
+                 spill: bool = Config("sbx_freeling.spill"),
+                 source_file: SourceFilename = SourceFilename(),
+                 fl_pool=None):
+    """Run FreeLing with dependency parsing and output the annotations of annotate_full plus dependency relations.
+
+    Parsing is done in the same FreeLing run as the tagging. The annotations are made on their own token and sentence
+    segments (sbx_freeling.dep_token and sbx_freeling.dep_sentence), so that corpora which do not use the parses are
+    not slowed down by the parser. The fl_pool argument is set by the preloader and should never be set from the
+    command line.
+    """
+    main(corpus_text, lang, conf_file, fl_binary, sentence_chunk, out_token, out_baseform, out_upos, out_pos,
+         out_sentence, sentence_annotation, timeout, out_ne_type, fl_pool=fl_pool, workers=workers,
+         batch_size=batch_size, cache=cache, cache_size=cache_size, coalesce_size=coalesce_size,
+         max_chunk_size=max_chunk_size, adaptive_timeout=adaptive_timeout, telemetry=telemetry, max_rss=max_rss,
+         max_chunks=max_chunks, backend=backend, source_file=source_file, out_deprel=out_deprel,
+         out_dephead=out_dephead, out_dephead_ref=out_dephead_ref, spill=spill, annotator_name="annotate_dep")
+
+
+@annotator("Analyse all documents with a shared set of FreeLing processes, largest documents first",
+           language=["ast", "cat", "deu", "eng", "fra", "glg", "ita", "nob", "por", "rus", "slv", "spa"])
+def annotate_corpus(source_files: AllSourceFilenames = AllSourceFilenames(),
+                    lang: Language = Language(),
+                    conf_file: Model = Model("[sbx_freeling.conf]"),
+                    fl_binary: Binary = Binary("[sbx_freeling.binary]"),
+                    sentence_chunk: Optional[AnnotationAllSourceFiles] = AnnotationAllSourceFiles(
+                        "[sbx_freeling.sentence_chunk]"),
+                    sentence_annotation: Optional[AnnotationAllSourceFiles] = AnnotationAllSourceFiles(
+                        "[sbx_freeling.sentence_annotation]"),
+                    out_analysis: OutputDataAllSourceFiles = OutputDataAllSourceFiles(
+                        "sbx_freeling.analysis", description="Serialized FreeLing analysis of every document"),
+                    timeout: int = Config("sbx_freeling.timeout"),
+                    workers: int = Config("sbx_freeling.workers"),
+                    batch_size: int = Config("sbx_freeling.batch_size"),
+                    cache: str = Config("sbx_freeling.cache"),
+                    cache_size: int = Config("sbx_freeling.cache_size"),
+                    coalesce_size: int = Config("sbx_freeling.coalesce_size"),
+                    max_chunk_size: int = Config("sbx_freeling.max_chunk_size"),
+                    adaptive_timeout: bool = Config("sbx_freeling.adaptive_timeout"),
+                    telemetry: str = Config("sbx_freeling.telemetry"),
+                    max_rss: int = Config("sbx_freeling.max_rss"),
+                    max_chunks: int = Config("sbx_freeling.max_chunks"),
+                    backend: str = Config("sbx_freeling.backend")):
+    """Run FreeLing on the whole corpus in one job and store the analysis of every document.
+
+    This is used by annotate and annotate_full when 'sbx_freeling.corpus_analysis' is set to 'sbx_freeling.analysis'.
+    """
+    analyse_corpus(source_files, lang, conf_file, fl_binary, sentence_chunk, sentence_annotation, out_analysis,
+                   timeout, workers=workers, batch_size=batch_size, cache=cache, cache_size=cache_size,
+                   coalesce_size=coalesce_size, max_chunk_size=max_chunk_size, adaptive_timeout=adaptive_timeout,
+                   telemetry=telemetry, max_rss=max_rss, max_chunks=max_chunks, backend=backend)
 
 
 def main(corpus_text, lang, conf_file, fl_binary, sentence_chunk, out_token, out_baseform, out_upos, out_pos,
-         out_sentence, sentence_annotation, timeout, out_ne_type=None):
-    """Read an XML or text document and process the text with FreeLing."""
-    # Init FreeLing as child process
-    fl_instance = Freeling(fl_binary, conf_file.path, lang, sentence_annotation, timeout)
+         out_sentence, sentence_annotation, timeout, out_ne_type=None, fl_pool=None, workers=1, batch_size=1,
+         cache="", cache_size=1024, coalesce_size=0, max_chunk_size=0, adaptive_timeout=False, telemetry="", max_rss=0,
+         max_chunks=0, backend="pipe", source_file=None, out_deprel=None, out_dephead=None,
+         out_dephead_ref=None, spill=False, corpus_analysis=None, annotator_name="annotate"):
+    """Read an XML or text document and process the text with FreeLing.
+
+    If 'corpus_analysis' is given, the analysis made by annotate_corpus() is written instead of running FreeLing.
+    If 'out_deprel' is given, FreeLing also parses the text and the dependency annotations are written. This cannot be
+    combined with 'sentence_annotation', since FreeLing may split the given sentences into several parse trees.
+    If 'spill' is set, the memory use does not grow with the size of the document: the text is read through a
+    SpilledText, and the annotations are written bit by bit while the document is analysed.
+    If 'telemetry' is set, a report of timers and counters for the document is added to the JSON file it points to,
+    under the name of the document and of the annotator ('annotator_name') that main() is run for.
+    """
+    if out_deprel is not None and sentence_annotation:
+        raise SparvErrorMessage("FreeLing's dependency parsing cannot be used together with "
+                                "'sbx_freeling.sentence_annotation', since FreeLing may split the given sentences and "
+                                "the dependency heads would then not be counted within them. Leave the setting empty "
+                                "to parse FreeLing's own sentences.")
+    writer = TokenWriter(out_token, out_baseform, out_upos, out_pos, out_sentence, out_ne_type, out_deprel,
+                         out_dephead, out_dephead_ref, sentences=not sentence_annotation)
+    if corpus_analysis is not None:
+        writer.write(TokenStore.from_bytes(base64.b64decode(corpus_analysis.read())))
+        return
+
+    started = time.perf_counter()
+    stats = Telemetry()
+    parse = out_deprel is not None
+
+    # Init FreeLing as child processes or in-process (or get already running ones from the pool)
+    if fl_pool is not None:
+        fl_instances = [fl_pool.acquire(backend, fl_binary, conf_file.path, lang, sentence_annotation, timeout,
+                                        adaptive_timeout, max_rss, max_chunks, parse)
+                        for _ in range(count_backends(backend, workers))]
+    else:
+        fl_instances = [make_backend(backend, fl_binary, conf_file.path, lang, sentence_annotation, timeout,
+                                     adaptive_timeout, max_rss, max_chunks, parse)
+                        for _ in range(count_backends(backend, workers))]
+
+    # Open the cache of previous analyses
+    analysis_cache = open_cache(cache, cache_size, conf_file, lang, backend, fl_instances[0]) if cache else None
+    all_tokens = TokenStore()
+
+    # Read the input while FreeLing is loading its dictionaries. With a cache FreeLing may not be needed at all, so it
+    # is then not waited for until the first chunk missing from the cache is sent to it (see process_lines()).
+    with ThreadPoolExecutor(max_workers=len(fl_instances)) as executor:
+        readiness = [] if analysis_cache else [executor.submit(fl_instance.wait_ready) for fl_instance in fl_instances]
+
+        read_started = time.perf_counter()
+        # In spill mode the text is read from a temporary file and the spans are kept in arrays
+        text_data = SpilledText.from_text(corpus_text) if spill else corpus_text.read()
+        if sentence_annotation:
+            # Go through all sentence spans and send text to FreeLing
+            spans = sentence_annotation.read_spans()
+            coalesce_size = 0
+        else:
+            # Go through all text spans and send text to FreeLing
+            spans = sentence_chunk.read_spans()
+            if max_chunk_size:
+                # Split oversized chunks into pieces that are analysed separately
+                spans = (piece for start, end in spans for piece in split_span(text_data, start, end, max_chunk_size))
+            batch_size = 1
+        spans = SpanView.from_spans(spans) if spill else list(spans)
+        stats.add("read_time", time.perf_counter() - read_started)
+
+        waiting = time.perf_counter()
+        try:
+            for ready in readiness:
+                ready.result()
+        except SparvErrorMessage:
+            for fl_instance in fl_instances:
+                fl_instance.kill()
+            raise
+        stats.add("startup_wait_time", time.perf_counter() - waiting)
+    stats.add("chunks", len(spans))
+    stats.add("chars", sum(end - start for start, end in spans))
+
+    analysis_started = time.perf_counter()
+    logger.progress(total=len(spans))
+    # In spill mode the spans are analysed a window at a time, and the annotations are written every SPILL_TOKENS
+    # tokens, so that neither the texts sent to FreeLing nor the analyses pile up in memory
+    windows = get_windows(spans, SPILL_WINDOW_SIZE) if spill else [spans]
+    try:
+        for window in windows:
+            for processed_output in run_spans(fl_instances, text_data, window, batch_size, analysis_cache,
+                                              coalesce_size):
+                all_tokens.extend(processed_output)
+                if spill and len(all_tokens) >= SPILL_TOKENS:
+                    writer.write(all_tokens)
+                    all_tokens = TokenStore()
+    except SparvErrorMessage:
+        # FreeLing could not be started when it was first needed
+        for fl_instance in fl_instances:
+            fl_instance.kill()
+        raise
+    if spill:
+        text_data.close()
+    stats.add("analysis_time", time.perf_counter() - analysis_started - writer.time)
+
+    # Write (the rest of the) annotations
+    writer.write(all_tokens)
+    stats.add("tokens", writer.written)
+    stats.add("write_time", writer.time)
+
+    if analysis_cache:
+        stats.add("cache_hits", analysis_cache.hits)
+        stats.add("cache_misses", analysis_cache.misses)
+        analysis_cache.close()
+
+    # Kill running subprocesses or hand them back to the pool
+    for fl_instance in fl_instances:
+        fl_instance.log_upos_cache_stats()
+        stats.merge(fl_instance.telemetry)
+        fl_instance.telemetry = Telemetry()
+        if fl_pool is not None:
+            fl_pool.release(fl_instance)
+        else:
+            fl_instance.kill()
+
+    stats.add("total_time", time.perf_counter() - started)
+    if telemetry:
+        write_report(telemetry, f"{source_file}:{annotator_name}", stats)
+
+
+def analyse_corpus(source_files, lang, conf_file, fl_binary, sentence_chunk, sentence_annotation, out_analysis, timeout,
+                   workers=1, batch_size=1, cache="", cache_size=1024, coalesce_size=0, max_chunk_size=0,
+                   adaptive_timeout=False, telemetry="", max_rss=0, max_chunks=0, backend="pipe"):
+    """Analyse all documents of a corpus with one shared set of FreeLing processes.
+
+    The spans of all documents are measured first, and the documents are then started largest first, with up to one
+    document per process at a time. The batches of every document are spread over whichever processes are free (see
+    run_spans()), so that a large document does not keep a single process busy long after the others have run out of
+    work. The analysis of each document is written to 'out_analysis' for that document as soon as it is complete.
+    """
+    started = time.perf_counter()
+    stats = Telemetry()
+    fl_instances = [make_backend(backend, fl_binary, conf_file.path, lang, sentence_annotation, timeout,
+                                 adaptive_timeout, max_rss, max_chunks)
+                    for _ in range(count_backends(backend, workers))]
 
-    text_data = corpus_text.read()
-    sentence_segments = []
-    all_tokens = []
+    # Measure all documents while FreeLing is loading its dictionaries (not waiting for it with a cache, as in main())
+    with ThreadPoolExecutor(max_workers=len(fl_instances)) as executor:
+        readiness = [] if cache else [executor.submit(fl_instance.wait_ready) for fl_instance in fl_instances]
 
+        read_started = time.perf_counter()
+        documents = []
+        for source_file in source_files:
+            if sentence_annotation:
+                spans = list(sentence_annotation.read_spans(source_file))
+            else:
+                spans = list(sentence_chunk.read_spans(source_file))
+                if max_chunk_size:
+                    text_data = Text(source_file).read()
+                    spans = [piece for start, end in spans
+                             for piece in split_span(text_data, start, end, max_chunk_size)]
+            documents.append((sum(end - start for start, end in spans), source_file, spans))
+        documents.sort(key=lambda document: document[0], reverse=True)
+        stats.add("read_time", time.perf_counter() - read_started)
+
+        waiting = time.perf_counter()
+        try:
+            for ready in readiness:
+                ready.result()
+        except SparvErrorMessage:
+            for fl_instance in fl_instances:
+                fl_instance.kill()
+            raise
+        stats.add("startup_wait_time", time.perf_counter() - waiting)
+    stats.add("chunks", sum(len(spans) for _, _, spans in documents))
+    stats.add("chars", sum(size for size, _, _ in documents))
     if sentence_annotation:
-        # Go through all sentence spans and send text to FreeLing
-        sentences_spans = sentence_annotation.read_spans()
-        sentences_spans = list(sentences_spans)
-        logger.progress(total=len(sentences_spans))
-        for sentence_span in sentences_spans:
-            inputtext = text_data[sentence_span[0]:sentence_span[1]]
-            processed_output = run_freeling(fl_instance, inputtext, sentence_span[0])
-            all_tokens.extend(processed_output)
-            logger.progress()
+        coalesce_size = 0
+    else:
+        batch_size = 1
+
+    free_instances = queue.Queue()
+    for fl_instance in fl_instances:
+        free_instances.put(fl_instance)
+
+    def analyse_document(document):
+        """Analyse one document with the shared processes and write its analysis."""
+        _, source_file, spans = document
+        text_data = Text(source_file).read()
+        # SQLite connections cannot be shared between threads
+        analysis_cache = open_cache(cache, cache_size, conf_file, lang, backend, fl_instances[0]) if cache else None
+        tokens = TokenStore()
+        for processed_output in run_spans(fl_instances, text_data, spans, batch_size, analysis_cache, coalesce_size,
+                                          free_instances):
+            tokens.extend(processed_output)
+        out_analysis.write(base64.b64encode(tokens.to_bytes()).decode("ascii"), source_file)
+        if analysis_cache:
+            analysis_cache.close()
+            return len(tokens), analysis_cache.hits, analysis_cache.misses
+        return len(tokens), 0, 0
+
+    analysis_started = time.perf_counter()
+    logger.progress(total=sum(len(spans) for _, _, spans in documents))
+    try:
+        with ThreadPoolExecutor(max_workers=len(fl_instances)) as executor:
+            for n_tokens, hits, misses in executor.map(analyse_document, documents):
+                stats.add("tokens", n_tokens)
+                stats.add("cache_hits", hits)
+                stats.add("cache_misses", misses)
+    except SparvErrorMessage:
+        for fl_instance in fl_instances:
+            fl_instance.kill()
+        raise
+    stats.add("analysis_time", time.perf_counter() - analysis_started)
+
+    for fl_instance in fl_instances:
+        fl_instance.log_upos_cache_stats()
+        stats.merge(fl_instance.telemetry)
+        fl_instance.kill()
+
+    stats.add("total_time", time.perf_counter() - started)
+    if telemetry:
+        write_report(telemetry, CORPUS_REPORT_NAME, stats)
+
+
+def open_cache(cache, cache_size, conf_file, lang, backend, fl_instance):
+    """Open the AnalysisCache at path 'cache' for the analyses made by 'fl_instance' and other backends like it."""
+    with open(conf_file.path, "rb") as f:
+        conf_data = f.read()
+    return AnalysisCache(cache, cache_size * 1024 * 1024,
+                         [conf_data, lang, " ".join(get_ne_flags(lang)), backend, fl_instance.version(),
+                          "parse" if fl_instance.parse else "", str(CACHE_FORMAT)])
+
+
+def run_spans(fl_instances, text_data, spans, batch_size=1, analysis_cache=None, coalesce_size=0,
+              free_instances=None):
+    """Send the text of each span to FreeLing and yield the analyses in span order.
 
+    If an AnalysisCache is given, spans found in the cache are not sent to FreeLing, and new analyses are added to
+    the cache. The other spans are sent in batches of 'batch_size' spans, which are pipelined through FreeLing.
+    If 'coalesce_size' is set, consecutive spans are instead put together into one request of at most that many
+    characters (see run_freeling_batch).
+
+    If there is more than one FreeLing process, the batches are spread over all of them. Every process is only used by
+    one thread at a time, so that its offset tracking (next_begin) stays correct. The processes that are free are taken
+    from the queue 'free_instances' if given, which lets several documents share the same processes.
+    """
+    if analysis_cache:
+        yield from run_spans_cached(fl_instances, text_data, spans, batch_size, analysis_cache, coalesce_size,
+                                    free_instances)
+        return
+
+    if coalesce_size:
+        batches = []
+        batch_length = 0
+        for start, end in spans:
+            # Every span but the first in a batch also needs a separator
+            if not batches or batch_length + 1 + end - start > coalesce_size:
+                batches.append([])
+                batch_length = -1
+            batches[-1].append((text_data[start:end], start))
+            batch_length += 1 + end - start
     else:
-        # Go through all text spans and send text to FreeLing
-        text_spans = sentence_chunk.read_spans()
-        text_spans = list(text_spans)
-        logger.progress(total=len(text_spans))
-        for text_span in text_spans:
-            inputtext = text_data[text_span[0]:text_span[1]]
-            processed_output = run_freeling(fl_instance, inputtext, text_span[0])
-            for s in processed_output:
-                all_tokens.extend(s)
-                sentence_segments.append((s[0].start, s[-1].end))
-                logger.progress()
-
-    # Write annotations
-    if all_tokens:
-        out_token.write([(t.start, t.end) for t in all_tokens])
-        out_upos.write([t.upos for t in all_tokens])
-        out_pos.write([t.pos for t in all_tokens])
-        out_baseform.write([t.baseform for t in all_tokens])
-    if out_ne_type:
-        out_ne_type.write([t.name_type for t in all_tokens])
-    # TODO: Sparv does not support optional outputs yet, so always write out_sentence, even if it's empty
-    out_sentence.write(sentence_segments)
-
-    # Kill running subprocess
-    fl_instance.kill()
-
-
-class Freeling:
-    """Handle the FreeLing process."""
-
-    def __init__(self, fl_binary, conf_file, lang, sentence_annotation, timeout):
-        """Set properties and start FreeLing process."""
-        self.binary = util.system.find_binary(fl_binary)
+        batches = [[(text_data[start:end], start) for start, end in spans[i:i + batch_size]]
+                   for i in range(0, len(spans), batch_size)]
+    coalesce = bool(coalesce_size)
+
+    if len(fl_instances) == 1 and free_instances is None:
+        for batch in batches:
+            yield from run_freeling_batch(fl_instances[0], batch, coalesce)
+            logger.progress(advance=len(batch))
+        return
+
+    if free_instances is None:
+        free_instances = queue.Queue()
+        for fl_instance in fl_instances:
+            free_instances.put(fl_instance)
+
+    def run_batch(batch):
+        waiting = time.perf_counter()
+        fl_instance = free_instances.get()
+        fl_instance.telemetry.add("queue_wait_time", time.perf_counter() - waiting)
+        try:
+            return run_freeling_batch(fl_instance, batch, coalesce)
+        finally:
+            free_instances.put(fl_instance)
+            logger.progress(advance=len(batch))
+
+    with ThreadPoolExecutor(max_workers=len(fl_instances)) as executor:
+        for processed_outputs in executor.map(run_batch, batches):
+            yield from processed_outputs
+
+
+def run_spans_cached(fl_instances, text_data, spans, batch_size, analysis_cache, coalesce_size=0, free_instances=None):
+    """Get the analyses of spans from the cache, send the rest to FreeLing and yield all analyses in span order."""
+    keys = [analysis_cache.key(text_data[start:end]) for start, end in spans]
+    cached = analysis_cache.get_many(keys)
+    misses = [span for span, key in zip(spans, keys) if key not in cached]
+    logger.debug("Found %d of %d chunks in the FreeLing cache", len(spans) - len(misses), len(spans))
+
+    analyses = run_spans(fl_instances, text_data, misses, batch_size, coalesce_size=coalesce_size,
+                         free_instances=free_instances)
+    new_entries = []
+    for (start, _), key in zip(spans, keys):
+        data = cached.get(key)
+        if data is not None:
+            yield TokenStore.from_bytes(data, start)
+            logger.progress()
+            continue
+        tokens = next(analyses)
+        # Don't cache the fake analyses of chunks that FreeLing could not process
+        if not tokens.fallback:
+            new_entries.append((key, tokens.to_bytes(start)))
+            if len(new_entries) >= CACHE_WRITE_SIZE:
+                analysis_cache.put_many(new_entries)
+                new_entries = []
+        yield tokens
+    analysis_cache.put_many(new_entries)
+
+
+def get_windows(spans, max_size):
+    """Split a sequence of spans into consecutive lists of spans with at most 'max_size' characters in total.
+
+    A span longer than 'max_size' gets a list of its own.
+    """
+    window = []
+    window_size = 0
+    for start, end in spans:
+        if window and window_size + end - start > max_size:
+            yield window
+            window = []
+            window_size = 0
+        window.append((start, end))
+        window_size += end - start
+    if window:
+        yield window
+
+
+def make_backend(backend, fl_binary, conf_file, lang, *args, **kwargs):
+    """Create a FreeLing backend: "pipe" (Freeling) or "pyfreeling" (PyFreeling)."""
+    if backend == "pyfreeling":
+        # Imported here since it imports from this module
+        from .pyfreeling_backend import PyFreeling
+        return PyFreeling(fl_binary, conf_file, lang, *args, **kwargs)
+    return Freeling(fl_binary, conf_file, lang, *args, **kwargs)
+
+
+def count_backends(backend, workers):
+    """Get the number of backends to analyse a document (or corpus) with, given the 'sbx_freeling.workers' setting.
+
+    FreeLing's Python bindings hold the GIL while analysing, so several "pyfreeling" backends would only multiply the
+    memory used for FreeLing's models. A single one is used instead.
+    """
+    if backend == "pyfreeling" and workers > 1:
+        logger.warning("The 'pyfreeling' backend cannot analyse text in parallel, so 'sbx_freeling.workers' is ignored")
+        return 1
+    return max(1, workers)
+
+
+def get_backend_key(backend, binary, conf_file, lang, parse=False):
+    """Get the settings that a backend is started with, used for deciding whether it can be reused."""
+    return backend, binary, str(conf_file), lang, tuple(get_ne_flags(lang)), parse
+
+
+class Backend(ABC):
+    """Base class for the ways of running FreeLing.
+
+    A backend turns chunks of text into TokenStores (analyze_batch()). It is prepared when created and may load its
+    models in the background until wait_ready() is called, and it is stopped with kill(). Backends that are alive can
+    be kept in a FreelingPool and reused for other documents. Subclasses must implement all abstract methods, or they
+    cannot be created.
+    """
+
+    name = None
+
+    def __init__(self, conf_file, lang, sentence_annotation, timeout, adaptive_timeout=False, max_rss=0,
+                 max_chunks=0, parse=False):
+        """Set properties common to all backends. If 'parse' is set, FreeLing also does dependency parsing."""
+        self.binary = None
         self.conf_file = conf_file
         self.lang = lang
-        self.sentence_annotation = sentence_annotation
-        self.start()
+        self.parse = parse
+        self.telemetry = Telemetry()  # Timers and counters, collected by main() after every document
         self.error = False
         self.tagset = "Penn" if self.lang == "eng" else "EAGLES"
+        self.upos_cache = {"": FALLBACK}  # Maps complete (possibly compound) FreeLing tags to UPOS
+        self.upos_cache_hits = 0
+        self.configure(sentence_annotation, timeout, adaptive_timeout, max_rss, max_chunks)
+
+    def configure(self, sentence_annotation, timeout, adaptive_timeout=False, max_rss=0, max_chunks=0):
+        """Set the properties that may differ between the documents a backend is used for."""
+        self.sentence_annotation = sentence_annotation
         self.timeout = timeout
+        self.adaptive_timeout = adaptive_timeout
+        self.max_rss = max_rss
+        self.max_chunks = max_chunks
+
+    @property
+    def key(self):
+        """Settings that FreeLing was started with, used for deciding whether the backend can be reused."""
+        return get_backend_key(self.name, self.binary, self.conf_file, self.lang, self.parse)
+
+    @abstractmethod
+    def version(self):
+        """Get a string identifying the FreeLing version, used for invalidating cached analyses."""
+
+    @abstractmethod
+    def wait_ready(self):
+        """Wait until FreeLing is ready to analyse text, raising SparvErrorMessage if it cannot be started."""
+
+    @abstractmethod
+    def analyze_batch(self, chunks, coalesce=False):
+        """Analyse a list of (inputtext, input_start_index) tuples and return one TokenStore per chunk."""
+
+    @abstractmethod
+    def kill(self):
+        """Stop FreeLing and free its resources."""
+
+    @abstractmethod
+    def is_alive(self):
+        """Check whether FreeLing can still be used."""
+
+    def get_upos(self, pos):
+        """Translate a FreeLing tag to UPOS. Compound tags (joined by '+') are translated part by part."""
+        upos = self.upos_cache.get(pos)
+        if upos is None:
+            started = time.perf_counter()
+            upos = self.upos_cache[pos] = "+".join(pos_to_upos(p, self.lang, self.tagset) for p in pos.split("+"))
+            self.telemetry.add("upos_time", time.perf_counter() - started)
+        else:
+            self.upos_cache_hits += 1
+        return upos
+
+    def log_upos_cache_stats(self):
+        """Log how well the UPOS cache has been working."""
+        lookups = self.upos_cache_hits + len(self.upos_cache) - 1
+        if lookups:
+            logger.debug("UPOS cache: %d distinct tags, %d lookups, %.1f%% hit rate", len(self.upos_cache) - 1,
+                         lookups, 100 * self.upos_cache_hits / lookups)
+
+
+class Freeling(Backend):
+    """Handle the FreeLing process (the "pipe" backend)."""
+
+    name = "pipe"
+
+    def __init__(self, fl_binary, conf_file, lang, sentence_annotation, timeout, adaptive_timeout=False, max_rss=0,
+                 max_chunks=0, parse=False):
+        """Set properties and start FreeLing process.
+
+        If 'max_rss' (MB) or 'max_chunks' is set, FreeLing is restarted between chunks once it uses more memory or has
+        processed more chunks than that, to keep memory leaks from slowing it down over long runs.
+        """
+        super().__init__(conf_file, lang, sentence_annotation, timeout, adaptive_timeout, max_rss, max_chunks, parse)
+        self.binary = util.system.find_binary(fl_binary)
+        self.processed_chars = 0  # Characters processed by FreeLing, used for measuring its speed
+        self.processing_time = 0.0  # Time spent processing these characters
         self.next_begin = 0  # FreeLing begin index of next output chunk (used as offset for calculating indexes)
-        self.restarted = False  # Indicates whether FreeLing has been restarted while processing the current chunk
+        self.start()
+
+    def __str__(self):
+        return f"FreeLing process {self.process.pid}"
+
+    def version(self):
+        """Get the version string of the FreeLing binary."""
+        return get_freeling_version(self.binary)
+
+    def analyze_batch(self, chunks, coalesce=False):
+        """Send several chunks of material to FreeLing at once and get the analysis of each chunk, using pipes.
+
+        Every chunk is followed by its own end marker, so that FreeLing can work on all of them without waiting for a
+        round trip between the chunks.
+
+        If 'coalesce' is set, the chunks are instead sent as a single request, separated by line breaks (which
+        FreeLing always treats as sentence breaks when flushing), and the analysis is split into chunks again by
+        character offset.
+        """
+        stripped_texts = [re.sub("\n", " ", inputtext) for inputtext, _ in chunks]
+        input_start_indices = [input_start_index for _, input_start_index in chunks]
+
+        if coalesce and len(chunks) > 1:
+            tokens = process_lines(self, ["\n".join(stripped_texts)], [0])[0]
+            return split_tokens(tokens, stripped_texts, input_start_indices)
+        return process_lines(self, stripped_texts, input_start_indices)
 
     def start(self):
         """Start the external FreeLingTool."""
-        ne_flags = []
-        # Do named entitiy recognition and classification if supported for language
-        if self.lang in NEC_LANGS:
-            ne_flags = ["--ner", "--nec"]
-        # Flags --nortkcon --nortk prevent FreeLing from splitting contractions
-        self.process = subprocess.Popen([self.binary, *ne_flags, "--outlv tagged", "--output json",
+        started = time.perf_counter()
+        ne_flags = get_ne_flags(self.lang)
+        # Flags --nortkcon --nortk prevent FreeLing from splitting contractions. With "--outlv dep" the JSON output of
+        # every sentence also contains its dependency tree.
+        outlv = "--outlv dep" if self.parse else "--outlv tagged"
+        self.process = subprocess.Popen([self.binary, *ne_flags, outlv, "--output json",
                                          "--nortkcon", "--nortk", "-f", self.conf_file, "--flush"],
                                         stdout=subprocess.PIPE,
                                         stdin=subprocess.PIPE,
                                         stderr=subprocess.PIPE,
                                         bufsize=0, start_new_session=True)
-        self.qerr = queue.Queue()
-        self.terr = threading.Thread(target=enqueue_output, args=(self.process.stderr, self.qerr))
-        self.terr.daemon = True  # thread dies with the program
-        self.terr.start()
+        # All pipes are handled by one non-blocking I/O loop (see poll())
+        for pipe in (self.process.stdin, self.process.stdout, self.process.stderr):
+            os.set_blocking(pipe.fileno(), False)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.process.stdout, selectors.EVENT_READ)
+        self.selector.register(self.process.stderr, selectors.EVENT_READ)
+        self.input_buffer = collections.deque()  # Memoryviews of input not yet written to stdin
+        self.output_lines = collections.deque()  # Complete lines read from stdout but not yet consumed
+        self.partial_output = b""  # Incomplete last line from stdout
+        self.partial_error = b""  # Incomplete last line from stderr
+        self.stdout_closed = False
+        self.stopped = False  # Whether kill() has been called for this process
+        # A deadline of a chunk given to an earlier process must not cut the startup of this one short
+        self.deadline = None  # Time by which the current chunk should have been processed
+        self.chunk_started = None  # Time when FreeLing started working on the current chunk
+        self.started = started
+        self.ready = False  # Whether FreeLing has answered the probe, i.e. loaded its dictionaries
+        self.chunks_processed = 0  # Chunks processed since FreeLing was started
+        self.rss_checked = time.monotonic()  # Last time the memory use of FreeLing was measured
+        self.telemetry.add("processes_started")
+        # Send a probe right away, so that FreeLing loads its dictionaries while we are doing other things
+        self.send(END + b"\n")
+
+    def wait_ready(self):
+        """Wait until FreeLing has answered the probe sent when it was started.
 
-        self.qout = queue.Queue()
-        self.tout = threading.Thread(target=enqueue_output, args=(self.process.stdout, self.qout))
-        self.tout.daemon = True  # thread dies with the program
-        self.tout.start()
+        Raise SparvErrorMessage if FreeLing exits or does not answer within the timeout, so that a broken setup is
+        reported immediately instead of as a timeout on the first chunk.
+        """
+        if self.ready:
+            return
+        reader = JsonReader()
+        for line in self.read_lines():
+            # The probe output sets next_begin to the offset of the first real chunk
+            for obj in reader.feed(line):
+                if process_json(self, obj, TokenStore(), 0):
+                    self.ready = True
+            if self.ready:
+                self.telemetry.add("startup_time", time.perf_counter() - self.started)
+                logger.debug("%s ready after %.1f s", self, time.perf_counter() - self.started)
+                return
+        if self.stdout_closed:
+            problem = "exited"
+        else:
+            problem = f"did not respond within {self.timeout} seconds"
+        self.kill()
+        raise SparvErrorMessage(f"FreeLing ({self.binary} -f {self.conf_file}) {problem} while starting up. Check "
+                                "the FreeLing installation and config file, and any FreeLing errors logged above.")
 
     def kill(self):
-        """Terminate current process."""
-        # Freeling spawns children, so we need to kill the whole process group
-        os.killpg(os.getpgid(self.process.pid), signal.SIGTERM)
+        """Terminate current process and wait for it to exit, using SIGKILL if SIGTERM is not enough.
+
+        Calling kill() again for the same process does nothing.
+        """
+        if self.stopped:
+            return
+        self.stopped = True
+        # Freeling spawns children, so we need to kill the whole process group (started with start_new_session, so
+        # its ID is the PID of FreeLing). The group is only signalled while FreeLing has not been reaped, since its
+        # ID may be reused after that.
+        pgid = self.process.pid
+        self._signal_group(signal.SIGTERM)
+        self.selector.close()
+        for pipe in (self.process.stdin, self.process.stdout, self.process.stderr):
+            try:
+                pipe.close()
+            except OSError:
+                pass
+        if not self._wait_exit(KILL_TIMEOUT):
+            logger.debug("FreeLing process %s did not exit after SIGTERM, sending SIGKILL", pgid)
+            self._signal_group(signal.SIGKILL)
+            self._wait_exit()
+        # Also kill any children that are still around (they are reaped by init once FreeLing is gone)
+        self._signal_group(signal.SIGKILL)
+        self.process.wait()
+
+    def _wait_exit(self, timeout=None):
+        """Wait until FreeLing has exited, and return False if it has not done so within 'timeout' seconds.
+
+        Where the system supports it, FreeLing is not reaped, so that its process group ID stays reserved until the
+        rest of the group has been killed.
+        """
+        if not hasattr(os, "waitid"):
+            try:
+                self.process.wait(timeout)
+            except subprocess.TimeoutExpired:
+                return False
+            return True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            try:
+                if os.waitid(os.P_PID, self.process.pid, os.WEXITED | os.WNOHANG | os.WNOWAIT) is not None:
+                    return True
+            except ChildProcessError:
+                # Already reaped (by is_alive())
+                return True
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+
+    def _signal_group(self, sig):
+        """Send a signal to the process group of FreeLing, unless FreeLing has already been reaped."""
+        if self.process.returncode is not None:
+            return
+        try:
+            os.killpg(self.process.pid, sig)
+        except ProcessLookupError:
+            # Already gone
+            pass
+
+    def send(self, data):
+        """Queue data to be written to FreeLing. The data is written by poll() whenever the pipe is ready for it."""
+        if not self.input_buffer:
+            self.selector.register(self.process.stdin, selectors.EVENT_WRITE)
+        self.input_buffer.append(memoryview(data))
+
+    def read_lines(self):
+        """Yield lines from FreeLing's stdout while writing any queued input.
+
+        Stops when FreeLing has not produced any output within the timeout, when the current chunk has not been
+        processed by its deadline, or when FreeLing's stdout has been closed.
+        """
+        while True:
+            while self.output_lines:
+                yield self.output_lines.popleft()
+            timeout = self.timeout
+            if self.deadline is not None:
+                timeout = min(timeout, self.deadline - time.monotonic())
+            if self.stdout_closed or timeout <= 0 or not self.poll(timeout):
+                self.telemetry.add("exits" if self.stdout_closed else "timeouts")
+                return
+
+    def start_chunk(self, length, time_per_char=None):
+        """Set the deadline for a chunk of 'length' characters that FreeLing starts working on now.
+
+        With adaptive timeouts the deadline is based on the speed FreeLing has had so far, so that a hanging chunk is
+        detected long before the configured timeout has passed. If 'time_per_char' is given (for the pieces of a chunk
+        that is retried), the chunk must also be processed within that many seconds per character.
+        """
+        self.chunk_started = time.monotonic()
+        self.deadline = None
+        if self.adaptive_timeout and self.processed_chars >= ADAPTIVE_MIN_CHARS:
+            expected = length * self.processing_time / self.processed_chars
+            self.deadline = self.chunk_started + max(ADAPTIVE_MIN_TIMEOUT, ADAPTIVE_FACTOR * expected)
+        if time_per_char is not None:
+            retry_deadline = self.chunk_started + max(MIN_RETRY_TIMEOUT, length * time_per_char)
+            self.deadline = retry_deadline if self.deadline is None else min(self.deadline, retry_deadline)
+
+    def end_chunk(self, length):
+        """Record the time it took to process a chunk of 'length' characters."""
+        self.processed_chars += length
+        self.processing_time += time.monotonic() - self.chunk_started
+        self.chunks_processed += 1
+        self.deadline = None
+
+    def poll(self, timeout):
+        """Wait until stdout has new data, handling stdin and stderr meanwhile.
+
+        Return False if there was no new data on stdout within the timeout.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            got_output = False
+            waiting = time.perf_counter()
+            events = self.selector.select(remaining)
+            io_started = time.perf_counter()
+            self.telemetry.add("wait_time", io_started - waiting)
+            for key, _ in events:
+                if key.fileobj is self.process.stdin:
+                    self._write_input()
+                elif key.fileobj is self.process.stdout:
+                    data = os.read(key.fd, READ_SIZE)
+                    if not data:
+                        self.selector.unregister(key.fileobj)
+                        self.stdout_closed = True
+                        return True
+                    lines = (self.partial_output + data).split(b"\n")
+                    self.partial_output = lines.pop()
+                    self.output_lines.extend(line + b"\n" for line in lines)
+                    got_output = got_output or bool(lines)
+                else:
+                    data = os.read(key.fd, READ_SIZE)
+                    if not data:
+                        self.selector.unregister(key.fileobj)
+                        continue
+                    lines = (self.partial_error + data).split(b"\n")
+                    self.partial_error = lines.pop()
+                    for line in lines:
+                        self._handle_error(line.decode(util.constants.UTF8, errors="replace"))
+            self.telemetry.add("io_time", time.perf_counter() - io_started)
+            if got_output:
+                return True
+
+    def _write_input(self):
+        """Write as much of the queued input as the stdin pipe will take."""
+        try:
+            while self.input_buffer:
+                data = self.input_buffer[0]
+                written = os.write(self.process.stdin.fileno(), data[:READ_SIZE])
+                if written < len(data):
+                    self.input_buffer[0] = data[written:]
+                else:
+                    self.input_buffer.popleft()
+        except BlockingIOError:
+            # Pipe is full, continue when FreeLing has consumed some of the input
+            return
+        except BrokenPipeError:
+            # FreeLing has exited, there is nobody to write to
+            self.input_buffer.clear()
+        self.selector.unregister(self.process.stdin)
+
+    def _handle_error(self, line):
+        """Log a line from FreeLing's stderr."""
+        if not line.strip():
+            return
+        # Ignore the "No rule to get short version of tag" error (http://nlp.lsi.upc.edu/freeling/node/655)
+        if line.startswith("TAGSET: No rule to get short version of tag"):
+            self.telemetry.add("stderr_lines_suppressed")
+            return
+        logger.warning("FreeLing error encountered: %s", line)
+        self.telemetry.add("stderr_lines_logged")
+        self.error = True
 
     def restart(self):
         """Restart current process."""
         self.kill()
         self.start()
-        self.restarted = True
+        self.telemetry.add("restarts")
+
+    def recycle_if_needed(self):
+        """Restart FreeLing if it has processed 'max_chunks' chunks or uses more than 'max_rss' MB of memory.
+
+        Must only be called between chunks, when FreeLing has no unprocessed input.
+        """
+        reason = None
+        if self.max_chunks and self.chunks_processed >= self.max_chunks:
+            reason = f"after {self.chunks_processed} chunks"
+        elif time.monotonic() - self.rss_checked >= RSS_CHECK_INTERVAL:
+            self.rss_checked = time.monotonic()
+            rss = get_rss(self.process.pid)
+            self.telemetry.maximum("peak_rss_mb", rss)
+            if self.max_rss and rss > self.max_rss:
+                reason = f"using {rss:.0f} MB of memory"
+        if reason:
+            logger.debug("Restarting %s %s", self, reason)
+            self.kill()
+            self.start()
+            self.telemetry.add("recycles")
+
+    def is_alive(self):
+        """Check whether the process is still running."""
+        return self.process.poll() is None
+
+
+class FreelingPool:
+    """Keep FreeLing processes running between documents to avoid reloading the dictionaries every time.
+
+    Processes (or in-process backends) are kept per combination of backend, binary, config file, language, NER flags
+    and whether they parse. Idle processes are stopped after 'idle_timeout' seconds (or never, if idle_timeout is None).
+    """
+
+    def __init__(self, idle_timeout=None):
+        """Set properties."""
+        self.idle_timeout = idle_timeout
+        self.idle = {}  # Maps Backend.key to a list of (Backend instance, time it was released)
+        self.lock = threading.Lock()
+        self.reaper = None
+
+    def acquire(self, backend, fl_binary, conf_file, lang, sentence_annotation, timeout, adaptive_timeout=False,
+                max_rss=0, max_chunks=0, parse=False):
+        """Get a running FreeLing backend for the given settings, starting a new one if none is available."""
+        binary = util.system.find_binary(fl_binary) if backend == Freeling.name else None
+        key = get_backend_key(backend, binary, conf_file, lang, parse)
+        with self.lock:
+            instances = self.idle.get(key, [])
+            while instances:
+                fl_instance, _ = instances.pop()
+                if fl_instance.is_alive():
+                    logger.debug("Reusing running %s", fl_instance)
+                    fl_instance.configure(sentence_annotation, timeout, adaptive_timeout, max_rss, max_chunks)
+                    return fl_instance
+        return make_backend(backend, fl_binary, conf_file, lang, sentence_annotation, timeout, adaptive_timeout,
+                            max_rss, max_chunks, parse)
+
+    def release(self, fl_instance):
+        """Hand a FreeLing process back to the pool."""
+        if not fl_instance.is_alive():
+            return
+        with self.lock:
+            self.idle.setdefault(fl_instance.key, []).append((fl_instance, time.monotonic()))
+            if self.idle_timeout and self.reaper is None:
+                self._schedule_reaper(self.idle_timeout)
+
+    def shutdown(self):
+        """Stop all idle FreeLing processes."""
+        with self.lock:
+            for instances in self.idle.values():
+                for fl_instance, _ in instances:
+                    fl_instance.kill()
+            self.idle = {}
+            if self.reaper is not None:
+                self.reaper.cancel()
+                self.reaper = None
+
+    def _schedule_reaper(self, delay):
+        self.reaper = threading.Timer(delay, self._reap)
+        self.reaper.daemon = True
+        self.reaper.start()
+
+    def _reap(self):
+        """Stop processes that have been idle for too long."""
+        with self.lock:
+            self.reaper = None
+            now = time.monotonic()
+            next_expiry = None
+            for key, instances in self.idle.items():
+                keep = []
+                for fl_instance, released in instances:
+                    if now - released >= self.idle_timeout:
+                        logger.debug("Stopping idle %s", fl_instance)
+                        fl_instance.kill()
+                    else:
+                        keep.append((fl_instance, released))
+                        expiry = released + self.idle_timeout - now
+                        next_expiry = expiry if next_expiry is None else min(next_expiry, expiry)
+                self.idle[key] = keep
+            if next_expiry is not None:
+                self._schedule_reaper(next_expiry)
 
 
 def run_freeling(fl_instance, inputtext, input_start_index):
-    """Send a chunk of material to FreeLing and get the analysis, using pipes."""
-    # Read stderr without blocking
-    try:
-        line = fl_instance.qerr.get(timeout=.1)
-        # Ignore the "No rule to get short version of tag" error (http://nlp.lsi.upc.edu/freeling/node/655)
-        line = line.decode()
-        if not line.startswith("TAGSET: No rule to get short version of tag"):
-            logger.warning("FreeLing error encountered: %s", line)
-            fl_instance.error = True
-    except queue.Empty:
-        # No errors, continue
-        pass
-
-    stripped_text = re.sub("\n", " ", inputtext)
-    # logger.debug("Sending input to FreeLing:\n" + stripped_text)
-
-    # Send material to FreeLing; Send blank lines for flushing; Send end-marker to know when to stop reading stdout
-    text = stripped_text.encode(util.constants.UTF8) + b"\n" + END + b"\n"
-
-    # Send input to FreeLing in thread (prevents blocking)
-    threading.Thread(target=pump_input, args=[fl_instance.process.stdin, text]).start()
-    # logger.debug("Done sending input to FreeLing!")
-
-    return process_lines(fl_instance, stripped_text, input_start_index)
-
-
-def process_lines(fl_instance, text, input_start_index):
-    """Read and process FreeLing output line by line."""
-    def make_empty_output():
-        """Generate fake FreeLing output in case input could not be processed."""
-        offset = fl_instance.next_begin
-        tokens = []
-        # Do dumb tokenisation: split on whitespace (but keep track of indexes)
-        for token, (b, e) in [(m.group(0), (m.start(), m.end())) for m in re.finditer(r"\S+", text)]:
-            t = {"begin": str(offset + b), "end": str(offset + e), "form": token, "lemma": token}
-            tokens.append(t)
-        # End position of the next token is irrelevant because next_begin will be reset to 0
-        tokens.append({"form": END.decode(), "end": str(-1)})
-        return [json.dumps({"sentences": [{"tokens": tokens}]})]
-
-    processed_output = []
-    empty_output = 0
+    """Send a chunk of material to FreeLing and get the analysis."""
+    return run_freeling_batch(fl_instance, [(inputtext, input_start_index)])[0]
 
-    # Read stdout without blocking
-    while True:
-        try:
-            line = fl_instance.qout.get(timeout=fl_instance.timeout)
 
-            if not line.strip():
-                empty_output += 1
-            else:
-                empty_output = 0
-                processed_output.append(line.decode())
-                # logger.debug("FreeLing output:\n" + line.decode().strip())
+def run_freeling_batch(fl_instance, chunks, coalesce=False):
+    """Get the analysis of several chunks of material at once from a FreeLing backend.
+
+    'chunks' is a list of (inputtext, input_start_index) tuples. If 'coalesce' is set, the pipe backend sends the
+    chunks to FreeLing as a single request (see Freeling.analyze_batch()).
+    """
+    return fl_instance.analyze_batch(chunks, coalesce)
+
+
+def split_span(text_data, start, end, max_size):
+    """Split a span into pieces of at most 'max_size' characters, at boundaries where FreeLing will end a sentence.
+
+    Pieces are preferably cut at blank lines, then after sentence-final punctuation, both searched for in the second
+    half of the piece to avoid very short pieces. If neither is found the span is cut at whitespace, or as a last
+    resort in the middle of a word. Only one piece of the text is sliced at a time, so 'text_data' may also be a
+    SpilledText.
+    """
+    pieces = []
+    while end - start > max_size:
+        limit = start + max_size
+        window = text_data[start:limit]
+        cut = None
+        for pattern in (BLANK_LINE, SENTENCE_END):
+            for m in pattern.finditer(window, max_size // 2):
+                cut = start + m.end()
+            if cut is not None:
+                break
+        else:
+            for m in WHITESPACE.finditer(window, 1):
+                cut = start + m.start()
+            if cut is None:
+                cut = limit
+        pieces.append((start, cut))
+        start = cut
+    pieces.append((start, end))
+    return pieces
+
+
+def find_cut(text):
+    """Find a position close to the middle of a text where it can be cut in two, or None if there is none.
+
+    Line breaks (separating coalesced chunks) are preferred over sentence-final punctuation, which is preferred over
+    any whitespace.
+    """
+    middle = len(text) // 2
+    for pattern in (LINE_BREAK, SENTENCE_END, WHITESPACE):
+        right = pattern.search(text, middle)
+        left = None
+        for left in pattern.finditer(text, 0, middle):
+            pass
+        candidates = [m.end() for m in (left, right) if m and 0 < m.end() < len(text)]
+        if candidates:
+            return min(candidates, key=lambda cut: abs(cut - middle))
+    return None
+
+
+def split_tokens(tokens, texts, input_start_indices):
+    """Split the analysis of several texts joined by line breaks into one TokenStore per text."""
+    outputs = []
+    offset = 0
+    for text, input_start_index in zip(texts, input_start_indices):
+        first = bisect.bisect_left(tokens.start, offset)
+        last = bisect.bisect_left(tokens.start, offset + len(text))
+        outputs.append(tokens.slice(first, last, input_start_index - offset))
+        offset += len(text) + 1
+    return outputs
+
+
+def process_lines(fl_instance, texts, input_start_indices, time_per_char=None):
+    """Send texts without line breaks to FreeLing and process the output line by line.
+
+    Every text is followed by an end marker, and the output is split into one output per text at the end markers.
+    Texts are sent while earlier ones are being processed, but with at most MAX_INPUT_AHEAD characters of unprocessed
+    input at a time. Every JSON object is turned into tokens as soon as it has been read, so only the lines of the
+    current sentence are kept as JSON. If 'time_per_char' is given, every text must be processed within that many
+    seconds per character (see Freeling.start_chunk()).
+    """
+    def send_more():
+        """Send texts to FreeLing until there is enough unprocessed input to keep it busy."""
+        nonlocal sent, input_ahead
+        while sent < len(texts) and (sent == len(outputs) or input_ahead < MAX_INPUT_AHEAD):
+            # Send material to FreeLing; Send end-marker to know when to stop reading stdout
+            # logger.debug("Sending input to FreeLing:\n" + texts[sent])
+            fl_instance.send(texts[sent].encode(util.constants.UTF8) + b"\n" + END + b"\n")
+            input_ahead += len(texts[sent])
+            sent += 1
+            fl_instance.telemetry.add("requests")
 
+    fl_instance.recycle_if_needed()
+    fl_instance.wait_ready()
+    outputs = []  # Processed output for each completed chunk
+    tokens = TokenStore()  # Tokens of the chunk currently read
+    sent = 0  # Number of texts sent to FreeLing
+    input_ahead = 0  # Number of characters sent to FreeLing but not yet processed
+    send_more()
+    reader = JsonReader()
+    empty_output = 0
+
+    # Read stdout without blocking
+    fl_instance.start_chunk(len(texts[0]), time_per_char)
+    for line in fl_instance.read_lines():
+        if not line.strip():
+            empty_output += 1
             # TODO: is this still needed?
             # No output recieved in a while. Skip this node and restart FreeLing.
             # (Multiple blank lines in input are ignored by FreeLing.)
             if empty_output > 5:
-                if not fl_instance.error:
-                    text_preview = text if len(text) <= 100 else text[:100] + "..."
-                    logger.warning("Something went wrong, FreeLing stopped responding. If this happens frequently you "
-                                   "could try increasing the 'sbx_freeling.timeout' config variable. The current input "
-                                   f"chunk will not be analyzed properly: '{text_preview}'")
-                fl_instance.restart()
-                processed_output = make_empty_output()
-                return process_json(fl_instance, processed_output, text, input_start_index)
-
-            # Reached end marker, all text processed!
-            if re.search(END, line):
-                return process_json(fl_instance, processed_output, text, input_start_index)
-
-        except queue.Empty:
-            # Freeling has not responded within the timeout. Skip this node and restart FreeLing.
-            text_preview = text if len(text) <= 100 else text[:100] + "..."
-            logger.warning("Something went wrong, FreeLing stopped responding. If this happens frequently you "
-                           "could try increasing the 'sbx_freeling.timeout' config variable. The current input "
-                           f"chunk will not be analyzed properly: '{text_preview}'")
-            fl_instance.restart()
-            processed_output = make_empty_output()
-            return process_json(fl_instance, processed_output, text, input_start_index)
-
-
-def process_json(fl_instance, json_lines, inputtext, input_start_index):
-    """Process json output from FreeLing into sentences and tokens."""
-    # logger.debug(f"input_start_index: {input_start_index}; next_begin: {fl_instance.next_begin}")
-    sentences = []
-    current_sentence = []
-
-    json_lines = "".join(json_lines)
-    decoder = json.JSONDecoder()
-    text = json_lines.lstrip()
-    while text:
-        obj, index = decoder.raw_decode(text)
-        text = text[index:].lstrip()
-        for sentence in obj.get("sentences", []):
-            # logger.debug(sentence)
-
-            if len(current_sentence):
-                sentences.append(current_sentence)
-                current_sentence = []
-
-            for token in sentence.get("tokens", []):
-                if token.get("form") == END.decode():
-                    # Store the last end position of the chunk
-                    fl_instance.next_begin = int(token.get("end")) + 1
-                else:
-                    current_sentence.append(make_token(fl_instance, token, inputtext, input_start_index))
+                break
+            continue
+        empty_output = 0
+        # logger.debug("FreeLing output:\n" + line.decode().strip())
 
-    # If FreeLing has been restarted while processing this chunk reset next_begin
-    if fl_instance.restarted:
-        fl_instance.next_begin = 0
-        fl_instance.restarted = False
+        # Parse the JSON objects completed by this line, keeping any incomplete one until the next line has been read
+        decode_started = time.perf_counter()
+        objects = reader.feed(line)
+        fl_instance.telemetry.add("json_time", time.perf_counter() - decode_started)
+        for obj in objects:
+            tokens_started = time.perf_counter()
+            end_reached = process_json(fl_instance, obj, tokens, input_start_indices[len(outputs)])
+            fl_instance.telemetry.add("token_time", time.perf_counter() - tokens_started)
 
-    # Append last sentence
-    if len(current_sentence):
-        sentences.append(current_sentence)
+            # Reached end marker, all text of this chunk processed!
+            if end_reached:
+                outputs.append(tokens)
+                tokens = TokenStore()
+                fl_instance.end_chunk(len(texts[len(outputs) - 1]))
+                if len(outputs) == len(texts):
+                    return outputs
+                fl_instance.start_chunk(len(texts[len(outputs)]), time_per_char)
+                input_ahead -= len(texts[len(outputs) - 1])
+                send_more()
 
-    # In case of an existing sentence_annotation: flatten sentences list to a single sentence
-    if fl_instance.sentence_annotation:
-        return [t for s in sentences for t in s]
-    else:
-        # logger.debug(sentences)
-        return sentences
+    # Freeling has not responded in time (or has exited). Restart FreeLing and analyse the chunk it got stuck on in
+    # smaller pieces, so that as little of it as possible is lost. The pieces share the time that the chunk got, so
+    # that a hanging piece takes about as long to find as the chunk took to fail.
+    completed = len(outputs)
+    failed_text = texts[completed]
+    chunk_time = fl_instance.timeout
+    if fl_instance.deadline is not None:
+        chunk_time = fl_instance.deadline - fl_instance.chunk_started
+    logger.debug("FreeLing stopped responding, restarting it and retrying in smaller pieces")
+    fl_instance.restart()
+    outputs.append(retry_in_pieces(fl_instance, failed_text, input_start_indices[completed],
+                                   chunk_time / max(1, len(failed_text))))
+
+    # Send the chunks that were never processed to the new FreeLing process
+    if completed + 1 < len(texts):
+        outputs.extend(process_lines(fl_instance, texts[completed + 1:], input_start_indices[completed + 1:],
+                                     time_per_char))
+    return outputs
+
+
+def retry_in_pieces(fl_instance, text, input_start_index, time_per_char):
+    """Analyse a text that FreeLing failed on by cutting it in two and analysing the halves separately.
+
+    Halves that fail are cut again, so that only the smallest failing pieces get the fallback tokenisation. Every piece
+    must be processed within 'time_per_char' seconds per character.
+    """
+    cut = find_cut(text)
+    # Coalesced chunks are always separated, so that every chunk is analysed as if it had been sent alone
+    if cut is None or (len(text) < MIN_RETRY_SIZE and "\n" not in text.strip()):
+        return make_fallback_output(fl_instance, text, input_start_index)
+    tokens = TokenStore()
+    for piece in process_lines(fl_instance, [text[:cut], text[cut:]], [input_start_index, input_start_index + cut],
+                               time_per_char):
+        tokens.extend(piece)
+    return tokens
+
+
+def make_fallback_output(fl_instance, text, input_start_index):
+    """Generate fake FreeLing output in case input could not be processed."""
+    if not fl_instance.error:
+        text_preview = text if len(text) <= 100 else text[:100] + "..."
+        logger.warning("Something went wrong, FreeLing stopped responding. If this happens frequently you "
+                       "could try increasing the 'sbx_freeling.timeout' config variable. The current input "
+                       f"chunk will not be analyzed properly: '{text_preview}'")
+    fl_instance.telemetry.add("fallback_chunks")
+    tokens = TokenStore()
+    tokens.fallback = True
+    # Do dumb tokenisation: split on whitespace (but keep track of indexes)
+    for m in re.finditer(r"\S+", text):
+        tokens.add(input_start_index + m.start(), input_start_index + m.end(), "", FALLBACK, m.group(0))
+        # Line breaks separate coalesced chunks, which must not end up in the same sentence
+        if text.startswith("\n", m.end()):
+            tokens.end_sentence()
+    tokens.end_sentence()
+    return tokens
+
+
+def process_json(fl_instance, obj, tokens, input_start_index):
+    """Process one json object from FreeLing into sentences and tokens, and add them to the TokenStore 'tokens'.
 
+    Return True if the object contains the end marker, i.e. FreeLing has processed all text sent before it.
+    """
+    # logger.debug(f"input_start_index: {input_start_index}; next_begin: {fl_instance.next_begin}")
+    end_reached = False
+    for sentence in obj.get("sentences", []):
+        # logger.debug(sentence)
+        dependencies = read_dependencies(sentence) if "dependencies" in sentence else {}
+        for token in sentence.get("tokens", []):
+            if token.get("form") == END_FORM:
+                # Store the last end position of the chunk
+                fl_instance.next_begin = int(token.get("end")) + 1
+                end_reached = True
+            else:
+                add_token(fl_instance, tokens, token, input_start_index, *dependencies.get(token.get("id"), ()))
+        tokens.end_sentence()
+    return end_reached
+
+
+def read_dependencies(sentence):
+    """Read the dependency tree of a FreeLing JSON sentence.
 
-def make_token(fl_instance, json_token, inputtext, input_start_index):
-    """Process one FreeLing token and extract relevant information."""
-    start = int(json_token.get("begin", -1)) - fl_instance.next_begin
-    end = int(json_token.get("end", -1)) - fl_instance.next_begin
-    word = inputtext[start:end]
+    Return a dictionary mapping token IDs to (head, relation) tuples, where head is the position of the head token in
+    the sentence (1-based, 0 for the root). The tree is walked with an explicit stack, so that every node is visited
+    once and deep trees cannot exceed the recursion limit.
+    """
+    positions = {token.get("id"): i for i, token in enumerate(sentence.get("tokens", []), 1)}
+    dependencies = {}
+    stack = [(node, 0) for node in sentence.get("dependencies", [])]
+    while stack:
+        node, head = stack.pop()
+        token_id = node.get("token")
+        dependencies[token_id] = (head, node.get("function", ""))
+        children = node.get("children")
+        if children:
+            position = positions.get(token_id, 0)
+            stack.extend((child, position) for child in children)
+    return dependencies
 
-    # logger.debug(f"word: '{word}', index: {start}-{end}, input: '{inputtext}'")
+
+def add_token(fl_instance, tokens, json_token, input_start_index, head=0, deprel=""):
+    """Process one FreeLing token, extract relevant information and add it to the TokenStore 'tokens'."""
     # input_start_index: Index of the first char in this chunk (relative to the entire input text)
-    start = input_start_index + start
-    end = input_start_index + end
+    start = input_start_index + int(json_token.get("begin", -1)) - fl_instance.next_begin
+    end = input_start_index + int(json_token.get("end", -1)) - fl_instance.next_begin
 
     baseform = json_token.get("lemma", "")
     pos = json_token.get("tag", "")
-    upos = []
-    if pos:
-        for p in pos.split("+"):
-            upos.append(pos_to_upos(p, fl_instance.lang, fl_instance.tagset))
-    else:
-        upos.append(FALLBACK)
-    upos = "+".join(upos)
+    upos = fl_instance.get_upos(pos)
     name_type = json_token.get("neclass", "")
 
-    return Token(word, pos, upos, baseform, name_type, start, end)
+    tokens.add(start, end, pos, upos, baseform, name_type, head, deprel)
 
 
 ################################################################################
 # Auxiliaries
 ################################################################################
 
-class Token:
-    """Object to store annotation information for a token."""
+@functools.lru_cache()
+def get_freeling_version(fl_binary):
+    """Get the version string of the FreeLing binary (empty if it cannot be determined)."""
+    try:
+        result = subprocess.run([fl_binary, "--version"], stdin=subprocess.DEVNULL, capture_output=True, timeout=60)
+    except (OSError, subprocess.TimeoutExpired):
+        return ""
+    return (result.stdout + result.stderr).decode(util.constants.UTF8, errors="replace").strip()
+
+
+def get_rss(pid):
+    """Get the memory (resident set size, in MB) used by a process and all its descendants, or 0 if unknown.
+
+    Only supported on systems with a Linux style /proc file system.
+    """
+    rss = 0
+    pids = [pid]
+    while pids:
+        pid = pids.pop()
+        try:
+            with open(f"/proc/{pid}/statm") as f:
+                rss += int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+            for task in os.listdir(f"/proc/{pid}/task"):
+                with open(f"/proc/{pid}/task/{task}/children") as f:
+                    pids.extend(int(child) for child in f.read().split())
+        except (OSError, ValueError, IndexError):
+            continue
+    return rss / (1024 * 1024)
+
+
+def get_ne_flags(lang):
+    """Get the FreeLing flags for named entity recognition and classification if supported for language."""
+    if lang in NEC_LANGS:
+        return ["--ner", "--nec"]
+    return []
+
+
+class JsonReader:
+    """Decode the JSON objects in FreeLing's output as soon as they are complete, reading the output line by line.
+
+    FreeLing spreads every sentence over many lines. Instead of trying to decode the pending output after every line,
+    the brackets outside of strings are counted, and the output is only decoded when all of them have been closed, so
+    that every line is only looked at once.
+    """
+
+    def __init__(self):
+        """Set properties."""
+        self.decoder = json.JSONDecoder()
+        self.lines = []  # Lines of the objects that are not yet complete
+        self.depth = 0  # Number of brackets opened in these lines but not closed
+
+    def feed(self, line):
+        """Add a line of output (as bytes) and return a list of the objects that it completes."""
+        text = line.decode(util.constants.UTF8)
+        # Without escaped backslashes and quotes, every other part between two quotes is outside of the strings
+        unescaped = text.replace("\\\\", "").replace('\\"', "") if "\\" in text else text
+        brackets = "".join(unescaped.split('"')[::2])
+        self.depth += brackets.count("{") + brackets.count("[") - brackets.count("}") - brackets.count("]")
+        self.lines.append(text)
+        if self.depth > 0:
+            return []
+
+        pending = "".join(self.lines).strip()
+        self.lines = []
+        self.depth = 0
+        objects = []
+        try:
+            while pending:
+                obj, index = self.decoder.raw_decode(pending)
+                objects.append(obj)
+                pending = pending[index:].lstrip()
+        except json.JSONDecodeError:
+            logger.warning("Could not decode FreeLing output: %s", pending[:100])
+        return objects
+
+
+class TokenStore:
+    """Annotation information for a sequence of tokens, stored column by column.
+
+    Token positions are kept in arrays and the string annotations are dictionary encoded, so that a token only takes
+    up a few machine words no matter how large the document is.
+    """
+
+    def __init__(self):
+        """Create empty columns."""
+        self.start = array("q")
+        self.end = array("q")
+        self.pos = StringColumn()
+        self.upos = StringColumn()
+        self.baseform = StringColumn()
+        self.name_type = StringColumn()
+        self.head = array("i")  # Position of the dependency head within the sentence (1-based, 0 for the root)
+        self.deprel = StringColumn()  # Dependency relation to the head
+        self.sentence_ends = array("q")  # Index after the last token of each sentence
+        self.fallback = False  # Whether the tokens come from the fallback tokenisation instead of FreeLing
+
+    def __len__(self):
+        return len(self.start)
+
+    def add(self, start, end, pos, upos, baseform, name_type="", head=0, deprel=""):
+        """Add a token."""
+        self.start.append(start)
+        self.end.append(end)
+        self.pos.append(pos)
+        self.upos.append(upos)
+        self.baseform.append(baseform)
+        self.name_type.append(name_type)
+        self.head.append(head)
+        self.deprel.append(deprel)
+
+    def end_sentence(self):
+        """End the current sentence (unless it is empty)."""
+        if len(self) > (self.sentence_ends[-1] if self.sentence_ends else 0):
+            self.sentence_ends.append(len(self))
+
+    def extend(self, other):
+        """Add all tokens and sentences from another TokenStore."""
+        offset = len(self)
+        self.start.extend(other.start)
+        self.end.extend(other.end)
+        self.pos.extend(other.pos)
+        self.upos.extend(other.upos)
+        self.baseform.extend(other.baseform)
+        self.name_type.extend(other.name_type)
+        self.head.extend(other.head)
+        self.deprel.extend(other.deprel)
+        self.sentence_ends.extend(offset + i for i in other.sentence_ends)
+        self.fallback = self.fallback or other.fallback
+
+    def to_bytes(self, offset=0):
+        """Serialize the tokens into a compact binary format, with positions relative to 'offset'."""
+        strings = StringColumn()
+        codes = array("I")
+        for column in (self.pos, self.upos, self.baseform, self.name_type, self.deprel):
+            translation = [strings.encode(value) for value in column.values]
+            codes.extend(translation[code] for code in column.data)
+        encoded_strings = [value.encode(util.constants.UTF8) for value in strings.values]
+        data = [
+            struct.pack("<III", len(self), len(self.sentence_ends), len(encoded_strings)),
+            array("q", (i - offset for i in self.start)).tobytes(),
+            array("q", (i - offset for i in self.end)).tobytes(),
+            self.sentence_ends.tobytes(),
+            self.head.tobytes(),
+            codes.tobytes(),
+            array("I", map(len, encoded_strings)).tobytes(),
+            *encoded_strings
+        ]
+        return zlib.compress(b"".join(data))
+
+    @classmethod
+    def from_bytes(cls, data, offset=0):
+        """Create a TokenStore from data serialized with to_bytes(), adding 'offset' to all positions."""
+        data = memoryview(zlib.decompress(data))
+        n_tokens, n_sentences, n_strings = struct.unpack_from("<III", data)
+        pos = struct.calcsize("<III")
 
-    def __init__(self, word, pos, upos, baseform, name_type="", start=-1, end=-1):
-        """Set attributes."""
-        self.word = word
-        self.pos = pos
-        self.upos = upos
-        self.baseform = baseform
-        self.name_type = name_type
+        def read_array(typecode, length):
+            nonlocal pos
+            values = array(typecode)
+            values.frombytes(data[pos:pos + length * values.itemsize])
+            pos += length * values.itemsize
+            return values
+
+        tokens = cls()
+        tokens.start = array("q", (i + offset for i in read_array("q", n_tokens)))
+        tokens.end = array("q", (i + offset for i in read_array("q", n_tokens)))
+        tokens.sentence_ends = read_array("q", n_sentences)
+        tokens.head = read_array("i", n_tokens)
+        codes = read_array("I", 5 * n_tokens)
+        strings = []
+        for length in read_array("I", n_strings):
+            strings.append(str(data[pos:pos + length], util.constants.UTF8))
+            pos += length
+        for i, column in enumerate((tokens.pos, tokens.upos, tokens.baseform, tokens.name_type, tokens.deprel)):
+            column.set_codes(strings, codes[i * n_tokens:(i + 1) * n_tokens])
+        return tokens
+
+    def slice(self, first, last, shift=0):
+        """Get a new TokenStore with the tokens from index 'first' up to 'last', with 'shift' added to all positions.
+
+        A sentence is always ended after the last token.
+        """
+        tokens = TokenStore()
+        tokens.start = array("q", (i + shift for i in self.start[first:last]))
+        tokens.end = array("q", (i + shift for i in self.end[first:last]))
+        for name in ("pos", "upos", "baseform", "name_type", "deprel"):
+            getattr(tokens, name).set_slice(getattr(self, name), first, last)
+        tokens.head = self.head[first:last]
+        tokens.sentence_ends = array("q", (i - first for i in self.sentence_ends if first < i < last))
+        tokens.end_sentence()
+        tokens.fallback = self.fallback
+        return tokens
+
+    def spans(self):
+        """Get a sequence of (start, end) tuples for all tokens."""
+        return SpanView(self.start, self.end)
+
+    def sentence_spans(self):
+        """Get a list of (start, end) tuples for all sentences."""
+        sentence_starts = itertools.chain([0], self.sentence_ends)
+        return [(self.start[b], self.end[e - 1]) for b, e in zip(sentence_starts, self.sentence_ends)]
+
+    def dependency_heads(self, offset=0):
+        """Get the dependency heads of all tokens, as lists of dephead and dephead_ref values.
+
+        dephead is the index of the head token (plus 'offset', the number of tokens before these in the document) and
+        dephead_ref its position in the sentence (1-based). Both are empty for the root of a sentence (and for tokens
+        without an analysis), with "-" for dephead as in the other Sparv parsers.
+        """
+        dephead = []
+        dephead_ref = []
+        sentence_start = 0
+        for sentence_end in itertools.chain(self.sentence_ends, [len(self)]):
+            for head in self.head[sentence_start:sentence_end]:
+                dephead.append(str(offset + sentence_start + head - 1) if head else "-")
+                dephead_ref.append(str(head) if head else "")
+            sentence_start = sentence_end
+        return dephead, dephead_ref
+
+
+class TokenWriter:
+    """Write the annotations of a document's tokens, either all at once or in several parts.
+
+    Every part after the first is appended to the annotation files, with the token indexes of dephead counted from the
+    start of the document. Parts must end with a complete sentence.
+    """
+
+    def __init__(self, out_token, out_baseform, out_upos, out_pos, out_sentence, out_ne_type=None, out_deprel=None,
+                 out_dephead=None, out_dephead_ref=None, sentences=True):
+        """Set the outputs. Sentence segments are only written if 'sentences' is set (otherwise they are empty)."""
+        self.out_token = out_token
+        self.out_baseform = out_baseform
+        self.out_upos = out_upos
+        self.out_pos = out_pos
+        self.out_sentence = out_sentence
+        self.out_ne_type = out_ne_type
+        self.out_deprel = out_deprel
+        self.out_dephead = out_dephead
+        self.out_dephead_ref = out_dephead_ref
+        self.sentences = sentences
+        self.written = 0  # Number of tokens written so far
+        self.time = 0.0  # Time spent writing
+
+    def write(self, tokens):
+        """Write the annotations of the tokens in a TokenStore."""
+        started = time.perf_counter()
+        append = self.written > 0
+        if len(tokens):
+            self.out_token.write(tokens.spans(), append=append)
+            self.out_upos.write(tokens.upos, append=append)
+            self.out_pos.write(tokens.pos, append=append)
+            self.out_baseform.write(tokens.baseform, append=append)
+        if self.out_ne_type:
+            self.out_ne_type.write(tokens.name_type, append=append)
+        if self.out_deprel:
+            dephead, dephead_ref = tokens.dependency_heads(self.written)
+            self.out_deprel.write(tokens.deprel, append=append)
+            self.out_dephead.write(dephead, append=append)
+            self.out_dephead_ref.write(dephead_ref, append=append)
+        # TODO: Sparv does not support optional outputs yet, so always write out_sentence, even if it's empty
+        self.out_sentence.write(tokens.sentence_spans() if self.sentences else [], append=append)
+        self.written += len(tokens)
+        self.time += time.perf_counter() - started
+
+
+class StringColumn(Sequence):
+    """Dictionary encoded list of strings.
+
+    The dictionary only holds strings that are used by some item of the column.
+    """
+
+    def __init__(self):
+        """Create an empty column."""
+        self.values = []  # Distinct strings
+        self.codes = {}  # Maps every distinct string to its index in self.values
+        self.data = array("I")  # Index in self.values for every item
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.values[code] for code in self.data[index]]
+        return self.values[self.data[index]]
+
+    def __iter__(self):
+        values = self.values
+        return (values[code] for code in self.data)
+
+    def encode(self, value):
+        """Get the code for a string, adding it to the dictionary if needed."""
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def append(self, value):
+        """Add a string to the end of the column."""
+        self.data.append(self.encode(value))
+
+    def set_codes(self, values, data):
+        """Make the items of this column the strings in 'values' at the indexes in 'data'.
+
+        Only the strings that are used are added to the dictionary. A slice of the tokens of a coalesced request, or of
+        an entry read from the cache, would otherwise carry a much larger dictionary along, which extend() and
+        TokenStore.to_bytes() would have to go through every time.
+        """
+        self.values = []
+        self.codes = {}
+        translation = {code: self.encode(values[code]) for code in dict.fromkeys(data)}
+        self.data = array("I", map(translation.__getitem__, data))
+
+    def set_slice(self, other, first, last):
+        """Make this column a copy of the items from index 'first' up to 'last' of another StringColumn."""
+        self.set_codes(other.values, other.data[first:last])
+
+    def extend(self, other):
+        """Add all strings from another StringColumn."""
+        translation = [self.encode(value) for value in other.values]
+        self.data.extend(translation[code] for code in other.data)
+
+
+class SpanView(Sequence):
+    """Read-only sequence of (start, end) tuples backed by two arrays."""
+
+    def __init__(self, start, end):
+        """Set columns."""
         self.start = start
         self.end = end
 
-    def __repr__(self):
-        return f"{self.word} <{self.baseform} {self.pos} {self.upos} {self.name_type}> ({self.start}-{self.end})"
-
+    @classmethod
+    def from_spans(cls, spans):
+        """Create a SpanView with the (start, end) tuples of an iterable."""
+        view = cls(array("q"), array("q"))
+        for start, end in spans:
+            view.start.append(start)
+            view.end.append(end)
+        return view
 
-def enqueue_output(out, queue):
-    """Auxiliary needed for reading without blocking."""
-    for line in iter(out.readline, b""):
-        queue.put(line)
-    out.close()
+    def __len__(self):
+        return len(self.start)
 
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(zip(self.start[index], self.end[index]))
+        return self.start[index], self.end[index]
 
-def pump_input(pipe, lines):
-    """Auxiliary for writing to pipe without blocking."""
-    pipe.write(lines)
-    # # If module stops working, maybe try splitting lines
-    # for line in lines.split(b"\n"):
-    #     pipe.write(line + b"\n")
+    def __iter__(self):
+        return zip(self.start, self.end)
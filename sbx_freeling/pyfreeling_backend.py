@@ -0,0 +1,203 @@
+"""Run FreeLing in-process through its Python bindings (the "pyfreeling" backend)."""
+
+import os
+import re
+import time
+
+from sparv.api import SparvErrorMessage, get_logger, util
+
+from .freeling import Backend, TokenStore, get_ne_flags
+
+logger = get_logger(__name__)
+
+# Default location of the FreeLing data files, used when the FREELINGSHARE environment variable is not set
+DEFAULT_FREELINGSHARE = "/usr/local/share/freeling"
+
+# Named entity classes of EAGLES tags for proper nouns (NP00SP0 etc.), as output by FreeLing
+NE_CLASSES = {"SP": "person", "G0": "location", "O0": "organization", "V0": "other"}
+
+# Values of the TaggerForceSelect option
+FORCE_SELECT = {"none": 0, "tagger": 1, "retok": 2}
+
+
+class PyFreeling(Backend):
+    """Analyse text with FreeLing's Python bindings, reading the analyses directly from the word objects.
+
+    This avoids starting a subprocess and serializing the analyses as JSON. The modules are set up from the same config
+    file as the pipe backend, and contractions are never split (like the --nortk and --nortkcon flags). The timeout
+    settings have no effect, since FreeLing cannot be interrupted when running in-process.
+    """
+
+    name = "pyfreeling"
+
+    def __init__(self, fl_binary, conf_file, lang, sentence_annotation, timeout, adaptive_timeout=False, max_rss=0,
+                 max_chunks=0, parse=False):
+        """Import the bindings. The modules are loaded by wait_ready(), which main() runs while reading the input."""
+        super().__init__(conf_file, lang, sentence_annotation, timeout, adaptive_timeout, max_rss, max_chunks, parse)
+        try:
+            import pyfreeling
+        except ImportError:
+            raise SparvErrorMessage("The 'pyfreeling' backend needs FreeLing's Python bindings (the 'pyfreeling' "
+                                    "module), which could not be imported. Install them or set 'sbx_freeling.backend' "
+                                    "to 'pipe'.")
+        self.pyfreeling = pyfreeling
+        self.modules = None
+        self.alive = True
+
+    def __str__(self):
+        return "in-process FreeLing"
+
+    def version(self):
+        """Get a string identifying the FreeLing bindings."""
+        return "pyfreeling " + getattr(self.pyfreeling, "__version__", "")
+
+    def wait_ready(self):
+        """Load the FreeLing modules given in the config file (if not already done)."""
+        if self.modules is not None:
+            return
+        started = time.perf_counter()
+        try:
+            self.modules = self._load_modules(read_config(self.conf_file))
+        except Exception as e:
+            self.alive = False
+            raise SparvErrorMessage(f"FreeLing could not be loaded with the config file {self.conf_file}: {e}")
+        self.telemetry.add("processes_started")
+        self.telemetry.add("startup_time", time.perf_counter() - started)
+        logger.debug("%s ready after %.1f s", self, time.perf_counter() - started)
+
+    def _load_modules(self, config):
+        """Create the FreeLing modules needed for tagging (and named entity classification and parsing) in order."""
+        pyfreeling = self.pyfreeling
+        ner = bool(get_ne_flags(self.lang))
+        pyfreeling.util_init_locale("default")
+
+        options = pyfreeling.maco_options(config.get("Lang", ""))
+        options.set_data_files(config.get("UserMapFile", ""), config.get("PunctuationFile", ""),
+                               config.get("DictionaryFile", ""), config.get("AffixFile", ""),
+                               config.get("CompoundFile", ""), config.get("LocutionsFile", ""),
+                               config.get("NPDataFile", ""), config.get("QuantitiesFile", ""),
+                               config.get("ProbabilityFile", ""))
+        morfo = pyfreeling.maco(options)
+        morfo.set_active_options(is_set(config, "UserMap"), is_set(config, "NumbersDetection"),
+                                 is_set(config, "PunctuationDetection"), is_set(config, "DatesDetection"),
+                                 is_set(config, "DictionarySearch"), is_set(config, "AffixAnalysis"),
+                                 is_set(config, "CompoundAnalysis"), False, is_set(config, "MultiwordsDetection"),
+                                 ner or is_set(config, "NERecognition"), is_set(config, "QuantitiesDetection"),
+                                 is_set(config, "ProbabilityAssignment"))
+
+        force = FORCE_SELECT.get(config.get("TaggerForceSelect", "retok").lower(), 2)
+        if config.get("Tagger", "hmm").lower() == "relax":
+            tagger = pyfreeling.relax_tagger(config.get("TaggerRelaxFile", ""),
+                                             int(config.get("TaggerRelaxMaxIter", 500)),
+                                             float(config.get("TaggerRelaxScaleFactor", 670.0)),
+                                             float(config.get("TaggerRelaxEpsilon", 0.001)), False, force)
+        else:
+            tagger = pyfreeling.hmm_tagger(config.get("TaggerHMMFile", ""), False, force)
+
+        modules = {
+            "tokenizer": pyfreeling.tokenizer(config.get("TokenizerFile", "")),
+            "splitter": pyfreeling.splitter(config.get("SplitterFile", "")),
+            "analyzers": [morfo, tagger]
+        }
+        if ner:
+            modules["analyzers"].append(pyfreeling.nec(config.get("NECFile", "")))
+        if self.parse:
+            modules["analyzers"].extend(self._load_parser(config))
+        modules["session"] = modules["splitter"].open_session()
+        return modules
+
+    def _load_parser(self, config):
+        """Create the dependency parser chosen by the DependencyParser option (and the chunk parser for txala)."""
+        pyfreeling = self.pyfreeling
+        parser = config.get("DependencyParser", "txala").lower()
+        if parser == "treeler":
+            return [pyfreeling.dep_treeler(config.get("DepTreelerFile", ""))]
+        if parser == "lstm":
+            return [pyfreeling.dep_lstm(config.get("DepLSTMFile", ""))]
+        # Txala builds the dependency tree from the output of the chunk parser
+        chunk_parser = pyfreeling.chart_parser(config.get("GrammarFile", ""))
+        return [chunk_parser, pyfreeling.dep_txala(config.get("DepTxalaFile", ""), chunk_parser.get_start_symbol())]
+
+    def analyze_batch(self, chunks, coalesce=False):
+        """Analyse every chunk separately. Coalescing makes no difference without a pipe."""
+        self.wait_ready()
+        return [self.analyze(inputtext, input_start_index) for inputtext, input_start_index in chunks]
+
+    def analyze(self, inputtext, input_start_index):
+        """Analyse one chunk of text and return its tokens as a TokenStore."""
+        self.telemetry.add("requests")
+        modules = self.modules
+        words = modules["tokenizer"].tokenize(inputtext)
+        # Flush the splitter, so that the last sentence ends with the chunk
+        sentences = modules["splitter"].split(modules["session"], words, True)
+        for analyzer in modules["analyzers"]:
+            sentences = analyzer.analyze(sentences)
+
+        started = time.perf_counter()
+        tokens = TokenStore()
+        ner = bool(get_ne_flags(self.lang))
+        for sentence in sentences:
+            dependencies = read_dependencies(sentence) if self.parse else {}
+            for i, word in enumerate(sentence.get_words()):
+                pos = word.get_tag()
+                tokens.add(input_start_index + word.get_span_start(), input_start_index + word.get_span_finish(), pos,
+                           self.get_upos(pos), word.get_lemma(), get_ne_class(pos) if ner else "",
+                           *dependencies.get(i, ()))
+            tokens.end_sentence()
+        self.telemetry.add("token_time", time.perf_counter() - started)
+        return tokens
+
+    def kill(self):
+        """Free the FreeLing modules."""
+        if self.modules is not None:
+            self.modules["splitter"].close_session(self.modules["session"])
+            self.modules = None
+        self.alive = False
+
+    def is_alive(self):
+        """Check whether the backend has not been stopped."""
+        return self.alive
+
+
+def read_config(path):
+    """Read a FreeLing config file into a dictionary, expanding environment variables such as $FREELINGSHARE."""
+    env = dict(os.environ)
+    env.setdefault("FREELINGSHARE", DEFAULT_FREELINGSHARE)
+    config = {}
+    with open(path, encoding=util.constants.UTF8) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#") or "=" not in line:
+                continue
+            name, _, value = line.partition("=")
+            value = re.sub(r"\$(\w+)", lambda m: env.get(m.group(1), m.group(0)), value.strip())
+            config[name.strip()] = value
+    return config
+
+
+def is_set(config, option):
+    """Check whether a yes/no option is enabled in a FreeLing config."""
+    return config.get(option, "no").lower() in ("yes", "true", "y", "1")
+
+
+def read_dependencies(sentence):
+    """Read the dependency tree of a FreeLing sentence object.
+
+    Return a dictionary mapping word positions (0-based) to (head, relation) tuples, where head is the position of the
+    head word (1-based, 0 for the root), like freeling.read_dependencies() does for JSON output.
+    """
+    dependencies = {}
+    stack = [(sentence.get_dep_tree().begin(), 0)]
+    while stack:
+        node, head = stack.pop()
+        position = node.get_word().get_position()
+        dependencies[position] = (head, node.get_label())
+        stack.extend((node.nth_child_ref(i), position + 1) for i in range(node.num_children()))
+    return dependencies
+
+
+def get_ne_class(pos):
+    """Get the named entity class from an EAGLES proper noun tag, the way FreeLing does in its JSON output."""
+    if pos.startswith("NP") and len(pos) >= 6:
+        return NE_CLASSES.get(pos[4:6], "")
+    return ""
@@ -0,0 +1,56 @@
+"""Access to the text of a document without keeping it in memory, used when 'sbx_freeling.spill' is set."""
+
+import os
+import tempfile
+
+from sparv.core import io
+
+# Number of characters to read from the corpus text at a time
+BLOCK_SIZE = 1048576
+
+# The text is stored as UTF-32, so that character offsets can be turned into byte offsets by multiplication
+ENCODING = "utf-32-le"
+CHAR_SIZE = 4
+
+
+class SpilledText:
+    """Read-only view of a document text that is stored in a temporary file.
+
+    Only len() and slicing are supported, which is all that the analysis needs. Slices are read with pread() rather
+    than through a memory map, since every page touched in a map would count towards the memory use of the process.
+    """
+
+    def __init__(self, blocks):
+        """Copy the text, given as an iterable of strings, to a temporary file."""
+        self.file = tempfile.TemporaryFile(prefix="sbx_freeling-")
+        for block in blocks:
+            self.file.write(block.encode(ENCODING))
+        self.file.flush()
+        self.length = self.file.tell() // CHAR_SIZE
+
+    @classmethod
+    def from_text(cls, corpus_text):
+        """Create a SpilledText from a Sparv Text, reading the corpus text file a block at a time."""
+        path = io.get_annotation_path(corpus_text.source_file, io.TEXT_FILE, data=True)
+        with io.open_annotation_file(path) as f:
+            return cls(iter(lambda: f.read(BLOCK_SIZE), ""))
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice) or index.step not in (None, 1):
+            raise TypeError("SpilledText only supports slicing")
+        start, stop, _ = index.indices(self.length)
+        if start >= stop:
+            return ""
+        size = (stop - start) * CHAR_SIZE
+        data = os.pread(self.file.fileno(), size, start * CHAR_SIZE)
+        # A single read returns at most about 2 GB
+        while len(data) < size:
+            data += os.pread(self.file.fileno(), size - len(data), start * CHAR_SIZE + len(data))
+        return data.decode(ENCODING)
+
+    def close(self):
+        """Delete the temporary file."""
+        self.file.close()
@@ -0,0 +1,114 @@
+"""Timers and counters describing where the time goes when running FreeLing, written as a JSON report."""
+
+import collections
+import fcntl
+import json
+import os
+from pathlib import Path
+
+from sparv.api import get_logger, util
+
+logger = get_logger(__name__)
+
+# Values that are recorded, in the order they appear in the report. Values ending in "_time" are in seconds.
+FIELDS = [
+    "total_time",  # Time spent in main() for the document
+    "read_time",  # Reading the corpus text and input spans
+    "analysis_time",  # Getting the analyses of all chunks (from FreeLing or the cache)
+    "write_time",  # Writing the output annotations
+    "startup_time",  # Starting FreeLing until it had answered its probe (i.e. loaded its dictionaries)
+    "startup_wait_time",  # Waiting for FreeLing to be ready after reading the input (the part of startup not hidden)
+    "wait_time",  # Waiting for FreeLing to produce output or accept input
+    "io_time",  # Reading from and writing to the FreeLing pipes
+    "json_time",  # Decoding FreeLing's JSON output
+    "token_time",  # Turning decoded JSON into tokens (including upos_time)
+    "upos_time",  # Translating tags not found in the UPOS cache
+    "queue_wait_time",  # Waiting for a free FreeLing process (with several workers)
+    "processes_started",
+    "chunks",  # Input spans (text chunks or sentences)
+    "chars",  # Characters in the input spans
+    "tokens",
+    "requests",  # Texts sent to FreeLing, including retries
+    "cache_hits",
+    "cache_misses",
+    "restarts",
+    "timeouts",  # FreeLing did not respond within the timeout or the adaptive deadline
+    "exits",  # FreeLing closed its output unexpectedly
+    "fallback_chunks",  # Texts that got the fallback tokenisation
+    "stderr_lines_logged",
+    "stderr_lines_suppressed",  # Known harmless messages on FreeLing's stderr that were ignored
+    "recycles",  # FreeLing restarted because of 'sbx_freeling.max_rss' or 'sbx_freeling.max_chunks'
+    "peak_rss_mb",  # Highest measured memory use of a FreeLing process (measured between chunks every few seconds)
+]
+
+# Values that are combined by taking the maximum instead of the sum
+MAX_FIELDS = {"peak_rss_mb"}
+
+
+class Telemetry:
+    """Collection of timers and counters.
+
+    Recording is a dictionary update, so it is cheap enough to be done unconditionally; whether a report is written is
+    decided by the 'sbx_freeling.telemetry' setting. Every FreeLing process has its own Telemetry object, so that
+    threads working with different processes never update the same one.
+    """
+
+    def __init__(self):
+        """Create an empty collection."""
+        self.values = collections.defaultdict(int)
+
+    def add(self, name, value=1):
+        """Add 'value' to a counter or timer."""
+        self.values[name] += value
+
+    def maximum(self, name, value):
+        """Raise a value to 'value' if it is lower."""
+        self.values[name] = max(self.values[name], value)
+
+    def merge(self, other):
+        """Add all values from another Telemetry object."""
+        for name, value in other.values.items():
+            if name in MAX_FIELDS:
+                self.maximum(name, value)
+            else:
+                self.values[name] += value
+
+    def report(self):
+        """Get all values as a dictionary, together with the resulting throughput."""
+        report = {name: round(self.values[name], 6) if isinstance(self.values[name], float) else self.values[name]
+                  for name in FIELDS}
+        report["tokens_per_second"] = round(report["tokens"] / report["total_time"], 1) if report["total_time"] else 0
+        return report
+
+
+def write_report(path, name, telemetry):
+    """Add a report to the JSON file at 'path' and update the corpus totals.
+
+    Reports are named by document and annotator ("<source file>:<annotator>"), since several annotators may run
+    FreeLing on the same document. The file is locked while being updated since several documents may be annotated in
+    parallel. A report replaces any earlier report with the same name, so the totals always describe the latest run.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path.with_name(path.name + ".lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        data = {"documents": {}}
+        if path.is_file():
+            try:
+                data = json.loads(path.read_text(encoding=util.constants.UTF8))
+            except ValueError:
+                logger.warning("Could not read the FreeLing telemetry report '%s', starting a new one", path)
+        data["documents"][name] = telemetry.report()
+
+        total = Telemetry()
+        for report in data["documents"].values():
+            for name in FIELDS:
+                if name in MAX_FIELDS:
+                    total.maximum(name, report.get(name, 0))
+                else:
+                    total.add(name, report.get(name, 0))
+        data["total"] = {"reports": len(data["documents"]), **total.report()}
+
+        tmp_path = path.with_name(path.name + ".tmp")
+        tmp_path.write_text(json.dumps(data, indent=2), encoding=util.constants.UTF8)
+        os.replace(tmp_path, path)
@@ -0,0 +1 @@
+"""Tests for the FreeLing wrapper, run against the fake FreeLing in the benchmarks directory."""
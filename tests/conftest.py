@@ -0,0 +1,65 @@
+"""Fixtures for running the FreeLing wrapper on the fake FreeLing in the benchmarks directory."""
+
+import importlib
+import json
+import sys
+
+import pytest
+from sparv.api import Text
+from sparv.core import log_handler, paths  # noqa: F401  log_handler adds the progress() method to loggers
+
+from sbx_freeling import freeling
+
+from .helpers import BENCHMARK_DIR, CONF_FILE, FAKE_BINARY, OUTPUTS, RecordingOutput, SpanAnnotation, make_document
+
+
+@pytest.fixture
+def work_dir(tmp_path, monkeypatch):
+    """Use a temporary Sparv work directory, for corpus texts and annotation data."""
+    monkeypatch.setattr(paths, "work_dir", tmp_path / "work")
+    return paths.work_dir
+
+
+@pytest.fixture
+def fake_bindings(monkeypatch):
+    """Make the fake bindings in the benchmarks directory importable as 'pyfreeling', for the "pyfreeling" backend."""
+    monkeypatch.syspath_prepend(str(BENCHMARK_DIR))
+    monkeypatch.setitem(sys.modules, "pyfreeling", importlib.import_module("fake_pyfreeling"))
+
+
+@pytest.fixture
+def document():
+    """A document of about 20000 characters, with text chunks of about 1000 characters and sentences as spans."""
+    return make_document(20000, 1000)
+
+
+@pytest.fixture
+def run(work_dir, tmp_path, fake_bindings):
+    """Get a function that runs freeling.main() on a text and returns its outputs and telemetry report.
+
+    The outputs are given as a dictionary of lists of values. Either 'chunks' or 'sentences' must be given, and 'parse'
+    runs the dependency parsing annotator. Other keyword arguments are passed on to main(). The report is None if
+    main() did not write one.
+    """
+    runs = 0
+
+    def run_main(text, chunks=None, sentences=None, parse=False, timeout=30, binary=FAKE_BINARY, **settings):
+        nonlocal runs
+        runs += 1
+        source_file = f"doc{runs}"
+        corpus_text = Text(source_file)
+        corpus_text.write(text)
+        outputs = {name: RecordingOutput() for name in OUTPUTS}
+        if parse:
+            settings.update(out_deprel=outputs["deprel"], out_dephead=outputs["dephead"],
+                            out_dephead_ref=outputs["dephead_ref"])
+        telemetry = tmp_path / "telemetry.json"
+        freeling.main(corpus_text, "spa", CONF_FILE, str(binary), SpanAnnotation(chunks) if chunks else None,
+                      outputs["token"], outputs["baseform"], outputs["upos"], outputs["pos"], outputs["sentence"],
+                      SpanAnnotation(sentences) if sentences else None, timeout, outputs["ne_type"],
+                      telemetry=str(telemetry), source_file=source_file, **settings)
+        report_name = f"{source_file}:{settings.get('annotator_name', 'annotate')}"
+        report = json.loads(telemetry.read_text())["documents"].get(report_name) if telemetry.is_file() else None
+        return {name: output.values for name, output in outputs.items()}, report
+
+    return run_main
@@ -0,0 +1,59 @@
+"""Stand-ins for the Sparv classes used by the FreeLing annotators, and access to the fake FreeLing."""
+
+import importlib.util
+import types
+from pathlib import Path
+
+BENCHMARK_DIR = Path(__file__).resolve().parent.parent / "benchmarks"
+FAKE_BINARY = BENCHMARK_DIR / "fake_analyze.py"
+
+OUTPUTS = ["token", "baseform", "upos", "pos", "ne_type", "sentence", "deprel", "dephead", "dephead_ref"]
+CONF_FILE = types.SimpleNamespace(path="/dev/null")
+
+
+def load_benchmarks():
+    """Load run_benchmarks.py by its path, without adding the benchmarks directory to sys.path."""
+    spec = importlib.util.spec_from_file_location("run_benchmarks", BENCHMARK_DIR / "run_benchmarks.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+make_document = load_benchmarks().make_document
+
+
+class RecordingOutput:
+    """Output that keeps the written values, appending if asked to."""
+
+    def __init__(self):
+        self.values = []
+
+    def write(self, values, append=False):
+        self.values = (self.values if append else []) + list(values)
+
+
+class RecordingData:
+    """Output of data for several documents, kept in memory."""
+
+    def __init__(self):
+        self.data = {}
+
+    def write(self, value, source_file):
+        self.data[source_file] = value
+
+    def for_document(self, source_file):
+        """Get the data of one document as an object with a read() method, like AnnotationData."""
+        return types.SimpleNamespace(read=lambda: self.data[source_file])
+
+
+class SpanAnnotation:
+    """Span annotation held in memory, either of one document (a list) or of several (a dictionary)."""
+
+    def __init__(self, spans):
+        self.spans = spans
+
+    def __bool__(self):
+        return True
+
+    def read_spans(self, source_file=None):
+        return iter(self.spans if source_file is None else self.spans[source_file])
@@ -0,0 +1,23 @@
+"""Tests of the cache of FreeLing analyses."""
+
+from sbx_freeling.cache import AnalysisCache
+
+
+def test_path_in_home(tmp_path, monkeypatch):
+    """A path starting with '~' is in the home directory, and missing directories are created."""
+    monkeypatch.setenv("HOME", str(tmp_path))
+    cache = AnalysisCache("~/.cache/sparv/freeling.db", 1024, ["settings"])
+    key = cache.key("Hola.")
+    cache.put_many([(key, b"data")])
+    cache.close()
+    assert (tmp_path / ".cache" / "sparv" / "freeling.db").is_file()
+
+    cache = AnalysisCache("~/.cache/sparv/freeling.db", 1024, ["settings"])
+    assert cache.get_many([key, cache.key("Adiós.")]) == {key: b"data"}
+    assert (cache.hits, cache.misses) == (1, 1)
+    cache.close()
+
+
+def test_settings():
+    """The same text gets different keys with different settings."""
+    assert AnalysisCache(":memory:", 1024, ["a"]).key("Hola.") != AnalysisCache(":memory:", 1024, ["b"]).key("Hola.")
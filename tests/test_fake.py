@@ -0,0 +1,19 @@
+"""The fake FreeLing in the benchmarks directory writes its output like FreeLing."""
+
+import subprocess
+
+from sbx_freeling import freeling
+
+from .helpers import FAKE_BINARY
+
+
+def test_output_layout():
+    """Every sentence is a JSON object with one token per line, which the wrapper reads like FreeLing's output."""
+    output = subprocess.run([str(FAKE_BINARY), "--output", "json", "--flush"], input="Hola mundo. Adiós.\n".encode(),
+                            capture_output=True, check=True).stdout
+    reader = freeling.JsonReader()
+    objects = [obj for line in output.splitlines(keepends=True) for obj in reader.feed(line)]
+    assert [[token["form"] for token in obj["sentences"][0]["tokens"]] for obj in objects] == [["Hola", "mundo", "."],
+                                                                                              ["Adiós", "."]]
+    # Three lines before the tokens of every sentence, and one line per token
+    assert len(output.splitlines()) == 3 * 2 + 5
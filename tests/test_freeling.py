@@ -0,0 +1,123 @@
+"""Tests of the parts of the FreeLing wrapper that can be used on their own."""
+
+import contextlib
+import multiprocessing
+import os
+import signal
+
+import pytest
+
+from sbx_freeling import freeling
+
+from .helpers import CONF_FILE, FAKE_BINARY
+
+
+def test_json_reader():
+    """Objects are returned when their last line has been read, also with brackets and escapes in strings."""
+    reader = freeling.JsonReader()
+    assert reader.feed(b'{ "sentences" : [\n') == []
+    assert reader.feed(b'  { "id":"1", "form" : "{[\\"\\\\" },\n') == []
+    assert reader.feed(b'  { "id":"2", "form" : "]}" }]}\n') == [{"sentences": [{"id": "1", "form": '{["\\'},
+                                                                                 {"id": "2", "form": "]}"}]}]
+    assert reader.feed(b'{"a": 1} {"b": [2]}\n') == [{"a": 1}, {"b": [2]}]
+
+
+def test_token_store_bytes():
+    """A TokenStore can be serialized and read back with its positions moved."""
+    tokens = freeling.TokenStore()
+    tokens.add(10, 14, "NCMS000", "NOUN", "casa", "", 0, "top")
+    tokens.add(15, 16, "Fp", "PUNCT", ".", "", 1, "f")
+    tokens.end_sentence()
+    tokens.add(17, 20, "NP00SP0", "PROPN", "ana", "person")
+    tokens.end_sentence()
+
+    copy = freeling.TokenStore.from_bytes(tokens.to_bytes(10), 100)
+    assert list(copy.spans()) == [(100, 104), (105, 106), (107, 110)]
+    assert list(copy.sentence_ends) == [2, 3]
+    for column in ("pos", "upos", "baseform", "name_type", "deprel"):
+        assert list(getattr(copy, column)) == list(getattr(tokens, column))
+    assert copy.dependency_heads(5) == (["-", "5", "-"], ["", "1", ""])
+
+
+def test_token_store_strings():
+    """Slices and deserialized copies of a TokenStore with a large vocabulary only keep the strings they use."""
+    tokens = freeling.TokenStore()
+    for i in range(10000):
+        tokens.add(2 * i, 2 * i + 1, "NCMS000", "NOUN", f"word{i}")
+    piece = tokens.slice(5000, 5010)
+    assert list(piece.baseform) == [f"word{i}" for i in range(5000, 5010)]
+    assert (len(piece.baseform.values), len(piece.pos.values)) == (10, 1)
+    data = piece.to_bytes()
+    assert len(data) < 500
+
+    copy = freeling.TokenStore.from_bytes(data)
+    assert list(copy.baseform) == list(piece.baseform)
+    assert (len(copy.baseform.values), len(copy.pos.values)) == (10, 1)
+    all_tokens = freeling.TokenStore()
+    all_tokens.extend(copy)
+    all_tokens.extend(tokens.slice(0, 10))
+    assert list(all_tokens.baseform) == list(piece.baseform) + [f"word{i}" for i in range(10)]
+    assert len(all_tokens.baseform.values) == 20
+
+def test_split_span():
+    """Oversized spans are cut at blank lines or after sentences, within the size limit."""
+    text = "One two three. Four five six.\n\nSeven eight nine ten eleven twelve"
+    pieces = freeling.split_span(text, 0, len(text), 20)
+    assert pieces[0] == (0, 14)
+    assert all(end - start <= 20 for start, end in pieces)
+    assert [text[start:end] for start, end in pieces][1] == " Four five six.\n\n"
+    assert pieces[-1][1] == len(text)
+
+
+def test_kill_twice():
+    """Stopping FreeLing twice does nothing the second time."""
+    fl_instance = freeling.Freeling(str(FAKE_BINARY), "/dev/null", "spa", None, 30)
+    fl_instance.wait_ready()
+    fl_instance.kill()
+    fl_instance.kill()
+    assert not fl_instance.is_alive()
+
+
+def test_incomplete_backend():
+    """A backend that does not implement all methods of the interface cannot be created."""
+    class NoKill(freeling.Backend):
+        def version(self):
+            return ""
+
+        def wait_ready(self):
+            pass
+
+        def analyze_batch(self, chunks, coalesce=False):
+            return []
+
+        def is_alive(self):
+            return True
+
+    with pytest.raises(TypeError, match="kill"):
+        NoKill("/dev/null", "spa", None, 30)
+
+
+def preload_and_exit(pids):
+    """Start a preloader, add a FreeLing process that is still starting up to its pool and exit."""
+    fl_pool = freeling.preloader(str(FAKE_BINARY), CONF_FILE, "spa", 30, 0, "pipe")
+    # The fake does not read its input (and so does not notice that it is closed) until the delay has passed
+    os.environ["FAKE_FREELING_STARTUP_DELAY"] = "60"
+    fl_instance = freeling.Freeling(str(FAKE_BINARY), "/dev/null", "spa", None, 30)
+    fl_pool.release(fl_instance)
+    pids.put(fl_instance.process.pid)
+
+
+def test_preloader_exit():
+    """The FreeLing processes of a preloader are stopped when it exits, also in a forked worker process."""
+    context = multiprocessing.get_context("fork")
+    pids = context.Queue()
+    worker = context.Process(target=preload_and_exit, args=(pids,))
+    worker.start()
+    pid = pids.get(timeout=30)
+    worker.join(30)
+    try:
+        with pytest.raises(ProcessLookupError):
+            os.kill(pid, 0)
+    finally:
+        with contextlib.suppress(ProcessLookupError):
+            os.kill(pid, signal.SIGKILL)
@@ -0,0 +1,147 @@
+"""The settings for speeding up the analysis must not change its result."""
+
+import pytest
+from sparv.api import SparvErrorMessage, Text
+
+from sbx_freeling import freeling
+
+from .helpers import CONF_FILE, FAKE_BINARY, RecordingData, SpanAnnotation, make_document
+
+
+@pytest.mark.parametrize("settings", [
+    {"workers": 3},
+    {"coalesce_size": 3000},
+    {"coalesce_size": 3000, "workers": 2},
+    {"max_chunk_size": 300},
+    {"max_chunk_size": 300, "workers": 2},
+    {"max_chunks": 3},
+    {"backend": "pyfreeling"},
+    {"backend": "pyfreeling", "coalesce_size": 3000},
+])
+def test_chunk_mode(run, document, settings):
+    """Analysing text chunks gives the same result as a single process sending one chunk at a time."""
+    text, chunks, _ = document
+    expected, _ = run(text, chunks=chunks)
+    assert expected["token"]
+    result, _ = run(text, chunks=chunks, **settings)
+    assert result == expected
+
+
+@pytest.mark.parametrize("settings", [
+    {"batch_size": 8},
+    {"batch_size": 8, "workers": 3},
+    {"coalesce_size": 3000},
+    {"backend": "pyfreeling", "batch_size": 8},
+])
+def test_sentence_mode(run, document, settings):
+    """Analysing existing sentences gives the same result as a single process sending one sentence at a time."""
+    text, _, sentences = document
+    expected, _ = run(text, sentences=sentences)
+    assert expected["token"]
+    assert expected["sentence"] == []
+    result, _ = run(text, sentences=sentences, **settings)
+    assert result == expected
+
+
+def test_pyfreeling_workers(run, document, caplog):
+    """Only one instance of the "pyfreeling" backend is used, whatever the number of workers."""
+    text, chunks, _ = document
+    expected, _ = run(text, chunks=chunks, backend="pyfreeling")
+    result, report = run(text, chunks=chunks, backend="pyfreeling", workers=3)
+    assert result == expected
+    assert report["processes_started"] == 1
+    assert "'sbx_freeling.workers' is ignored" in caplog.text
+
+
+@pytest.mark.parametrize("settings", [
+    {"workers": 2},
+    {"backend": "pyfreeling"},
+    {"spill": True},
+])
+def test_parse(run, document, settings, monkeypatch):
+    """Dependency parses are the same with all settings, and the other annotations are the same as without parsing."""
+    # Write the annotations in several parts in spill mode
+    monkeypatch.setattr(freeling, "SPILL_TOKENS", 500)
+    monkeypatch.setattr(freeling, "SPILL_WINDOW_SIZE", 3000)
+    text, chunks, _ = document
+    expected, _ = run(text, chunks=chunks, parse=True)
+    assert "-" in expected["dephead"] and "0" in expected["dephead"]
+    result, _ = run(text, chunks=chunks, parse=True, **settings)
+    assert result == expected
+
+    without_parse, _ = run(text, chunks=chunks)
+    assert without_parse == {**expected, "deprel": [], "dephead": [], "dephead_ref": []}
+
+
+def test_parse_sentences(run, document):
+    """Dependency parsing is refused with an existing sentence segmentation, which FreeLing may split."""
+    text, _, sentences = document
+    with pytest.raises(SparvErrorMessage, match="sbx_freeling.sentence_annotation"):
+        run(text, sentences=sentences, parse=True)
+
+
+@pytest.mark.parametrize("mode", ["chunks", "sentences"])
+def test_spill(run, document, monkeypatch, mode):
+    """Spill mode gives the same result although the annotations are written in several parts."""
+    monkeypatch.setattr(freeling, "SPILL_TOKENS", 500)
+    monkeypatch.setattr(freeling, "SPILL_WINDOW_SIZE", 3000)
+    text, chunks, sentences = document
+    spans = {"chunks": chunks} if mode == "chunks" else {"sentences": sentences}
+    expected, _ = run(text, **spans)
+    result, _ = run(text, spill=True, max_chunk_size=2000, **spans)
+    assert result == expected
+
+
+def test_cache(run, document, tmp_path):
+    """Analyses taken from the cache are the same as new ones, and FreeLing is not waited for if all are cached."""
+    text, chunks, _ = document
+    expected, _ = run(text, chunks=chunks)
+    cache = tmp_path / "cache" / "freeling.db"
+
+    first, report = run(text, chunks=chunks, cache=str(cache), workers=2)
+    assert first == expected
+    assert report["cache_misses"] == len(chunks)
+
+    second, report = run(text, chunks=chunks, cache=str(cache), workers=2)
+    assert second == expected
+    assert report["cache_hits"] == len(chunks)
+    assert report["requests"] == 0
+    assert report["startup_time"] == 0
+
+    # A changed chunk is sent to FreeLing, the rest are taken from the cache
+    changed = text[:chunks[0][0]] + text[chunks[0][0]:chunks[0][1]].upper() + text[chunks[0][1]:]
+    _, report = run(changed, chunks=chunks, cache=str(cache))
+    assert report["cache_misses"] == 1
+    assert report["cache_hits"] == len(chunks) - 1
+
+
+def test_preloader(run, document):
+    """Processes from the preloader's pool are reused for the next document and give the same result."""
+    text, chunks, _ = document
+    expected, _ = run(text, chunks=chunks)
+    fl_pool = freeling.preloader(str(FAKE_BINARY), CONF_FILE, "spa", 30, 0, "pipe")
+    try:
+        for processes_started in (1, 0):
+            result, report = run(text, chunks=chunks, fl_pool=fl_pool)
+            assert result == expected
+            assert report["processes_started"] == processes_started
+    finally:
+        fl_pool.shutdown()
+
+
+@pytest.mark.parametrize("settings", [{"workers": 2}, {"workers": 3, "coalesce_size": 3000, "max_chunk_size": 500}])
+def test_corpus_analysis(run, work_dir, settings):
+    """Analysing all documents at once gives the same annotations as analysing them one by one."""
+    documents = {f"corpus{i}": make_document(size, 1000, seed=i) for i, size in enumerate([15000, 2000, 6000])}
+    for source_file, (text, _, _) in documents.items():
+        Text(source_file).write(text)
+
+    analysis = RecordingData()
+    freeling.analyse_corpus(list(documents), "spa", CONF_FILE, str(FAKE_BINARY),
+                            SpanAnnotation({source_file: chunks for source_file, (_, chunks, _) in documents.items()}),
+                            None, analysis, 30, **settings)
+
+    for source_file, (text, chunks, _) in documents.items():
+        expected, _ = run(text, chunks=chunks)
+        result, _ = run(text, chunks=chunks, corpus_analysis=analysis.for_document(source_file))
+        assert result == expected
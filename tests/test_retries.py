@@ -0,0 +1,118 @@
+"""Chunks that FreeLing hangs or crashes on are retried in pieces, and only the failing piece gets the fallback."""
+
+import re
+
+import pytest
+from sparv.api import SparvErrorMessage
+
+from sbx_freeling import freeling
+
+# Settings for analysing the same text in different ways
+MODES = {
+    "chunks": {},
+    "coalesce": {"coalesce_size": 3000},
+    "sentences": {"batch_size": 8},
+}
+
+
+def add_word(document, word, chunk=5):
+    """Replace a four letter word in the middle of a text chunk with 'word', which must also have four letters.
+
+    Return the new text and the position of the word.
+    """
+    text, chunks, _ = document
+    start = (chunks[chunk][0] + chunks[chunk][1]) // 2
+    m = re.compile(r"\b(text|tags|with|many|such)\b").search(text, start)
+    return text[:m.start()] + word + text[m.end():], m.start()
+
+
+def get_spans(document, mode):
+    """Get the keyword argument with the input spans to use in a mode."""
+    _, chunks, sentences = document
+    return {"sentences": sentences} if mode == "sentences" else {"chunks": chunks}
+
+
+def check_fallback(result, expected, position):
+    """Check that only a short piece around 'position' got the fallback tokenisation and everything else is as expected.
+
+    The fallback tokens have empty part-of-speech tags.
+    """
+    tokens = list(zip(result["token"], result["baseform"], result["pos"]))
+    fallback = [i for i, (_, _, pos) in enumerate(tokens) if pos == ""]
+    assert fallback == list(range(fallback[0], fallback[-1] + 1))
+    fallback_start, fallback_end = tokens[fallback[0]][0][0], tokens[fallback[-1]][0][1]
+    assert fallback_start <= position < fallback_end
+    assert len(fallback) < 25
+
+    analysed = {token for token in tokens if token[2]}
+    expected = set(zip(expected["token"], expected["baseform"], expected["pos"]))
+    outside = {token for token in expected if token[0][1] <= fallback_start or token[0][0] >= fallback_end}
+    assert outside <= analysed <= expected
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_hang(run, document, monkeypatch, mode):
+    """FreeLing is restarted when it does not respond within the timeout, and the chunk is retried in pieces."""
+    text, position = add_word(document, "Hang")
+    spans = get_spans(document, mode)
+    expected, _ = run(text, **spans, **MODES[mode])
+
+    monkeypatch.setenv("FAKE_FREELING_HANG_ON", "Hang")
+    result, report = run(text, **spans, **MODES[mode], timeout=1, adaptive_timeout=False)
+    check_fallback(result, expected, position)
+    assert report["fallback_chunks"] == 1
+    assert report["timeouts"] >= 1
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_crash(run, document, monkeypatch, mode):
+    """FreeLing is restarted when it exits, and the chunk is retried in pieces."""
+    text, position = add_word(document, "Boom")
+    spans = get_spans(document, mode)
+    expected, _ = run(text, **spans, **MODES[mode])
+
+    monkeypatch.setenv("FAKE_FREELING_CRASH_ON", "Boom")
+    result, report = run(text, **spans, **MODES[mode], workers=2)
+    check_fallback(result, expected, position)
+    assert report["fallback_chunks"] == 1
+    assert report["exits"] >= 1
+
+
+def test_startup_failure(run, document):
+    """An error is raised right away if FreeLing exits while starting up."""
+    text, chunks, _ = document
+    with pytest.raises(SparvErrorMessage, match="exited while starting up"):
+        run(text, chunks=chunks, binary="/bin/false", workers=2)
+
+
+@pytest.mark.parametrize("mode", ["chunks", "coalesce"])
+def test_hang_after_adaptive_deadline(run, document, monkeypatch, mode):
+    """FreeLing can be started again after missing an adaptive deadline, and the chunk is retried in pieces."""
+    monkeypatch.setattr(freeling, "ADAPTIVE_MIN_TIMEOUT", 1)
+    # The chunk with the word comes after ADAPTIVE_MIN_CHARS characters, so that it gets an adaptive deadline
+    text, position = add_word(document, "Hang", chunk=12)
+    assert position > freeling.ADAPTIVE_MIN_CHARS
+    spans = get_spans(document, mode)
+    expected, _ = run(text, **spans, **MODES[mode])
+
+    monkeypatch.setenv("FAKE_FREELING_HANG_ON", "Hang")
+    result, report = run(text, **spans, **MODES[mode], timeout=30, adaptive_timeout=True)
+    check_fallback(result, expected, position)
+    assert report["fallback_chunks"] == 1
+    assert report["total_time"] < 30
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_retry_time(run, document, monkeypatch, mode):
+    """The pieces of a chunk that FreeLing hangs on share the time the chunk got, instead of getting it each."""
+    monkeypatch.setattr(freeling, "MIN_RETRY_TIMEOUT", 0.2)
+    text, position = add_word(document, "Hang")
+    spans = get_spans(document, mode)
+    expected, _ = run(text, **spans, **MODES[mode])
+
+    monkeypatch.setenv("FAKE_FREELING_HANG_ON", "Hang")
+    timeout = 3
+    result, report = run(text, **spans, **MODES[mode], timeout=timeout, adaptive_timeout=False)
+    check_fallback(result, expected, position)
+    # One timeout for the chunk, and about one more for all of its pieces that hang (plus restarts)
+    assert report["total_time"] < 3 * timeout
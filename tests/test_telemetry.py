@@ -0,0 +1,20 @@
+"""Tests of the telemetry report."""
+
+import json
+
+from sbx_freeling.telemetry import Telemetry, write_report
+
+
+def test_reports_per_annotator(tmp_path):
+    """Annotators run on the same document get reports of their own, which replace their earlier reports."""
+    path = tmp_path / "telemetry.json"
+    for name, tokens in [("doc:annotate_full", 10), ("doc:annotate_dep", 5), ("doc:annotate_full", 20)]:
+        telemetry = Telemetry()
+        telemetry.add("tokens", tokens)
+        write_report(path, name, telemetry)
+
+    data = json.loads(path.read_text())
+    assert {name: report["tokens"] for name, report in data["documents"].items()} == {"doc:annotate_full": 20,
+                                                                                    "doc:annotate_dep": 5}
+    assert data["total"]["reports"] == 2
+    assert data["total"]["tokens"] == 25